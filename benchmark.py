@@ -0,0 +1,282 @@
+"""
+Generation pipeline benchmarks.
+
+Boards come from benchmark_grids.txt, a fixed set of solution grids, so that runs are comparable and
+need no Redis. Results can be saved as JSON with --output and compared with the `compare` command.
+With --profile, the benchmark runs under cProfile and the stats are saved for tools like snakeviz or
+flameprof; for a sampling flamegraph, run the benchmark under `py-spy record -o flame.svg -- python benchmark.py ...`.
+"""
+import argparse
+import cProfile
+import json
+import os
+import platform
+import pstats
+import random
+import time
+from typing import Optional
+
+import numpy as np
+import redis
+
+from bitboard import cells_to_mask, dot_maps
+from generator import UniquenessOracle, SolverBackend, SearchCost, SearchMode, DEFAULT_SEARCH_COST, \
+    DEFAULT_SEARCH_MODE, find_seed_guided, minimize_mask, grid_coords
+from graph import SearchStats
+from ken import entries_to_grids, decode_ken_arrays, encode_ken, read_kens, ken_to_grid
+
+BENCHMARK_GRIDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_grids.txt")
+
+
+def load_grids(count: Optional[int] = None, path: str = BENCHMARK_GRIDS_PATH) -> list[np.ndarray]:
+    grids = [ken_to_grid(ken) for ken in read_kens(path)]
+    return grids[:count] if count is not None else grids
+
+
+def load_redis_solutions(count: int) -> list[np.ndarray]:
+    r = redis.from_url(os.getenv("REDIS_KEYS_URL"))
+
+    return list(entries_to_grids(r.srandmember("sudokus", count)))
+
+
+def summarize(values: list[float]) -> dict:
+    return {
+        "mean": float(np.mean(values)),
+        "median": float(np.median(values)),
+        "max": float(np.max(values)),
+    }
+
+
+def benchmark_solver_backends(solutions: list[np.ndarray], queries_per_board: int = 50, seed: int = 0) -> dict:
+    # Times the same random uniqueness queries (5 to 30 givens) on every backend
+    rng = random.Random(seed)
+    queries = [
+        [cells_to_mask(rng.sample(sorted(grid_coords()), rng.randint(5, 30))) for _ in range(queries_per_board)]
+        for _ in solutions
+    ]
+
+    results = {}
+    for backend in SolverBackend:
+        answers = []
+        start = time.perf_counter()
+
+        for solution, board_queries in zip(solutions, queries):
+            oracle = UniquenessOracle(solution, cache_size=0, backend=backend)
+            answers.append([oracle.is_unique(q) for q in board_queries])
+
+        elapsed = time.perf_counter() - start
+        results[backend.name.lower()] = {
+            "seconds": elapsed,
+            "queries": len(solutions) * queries_per_board,
+            "per_query_ms": 1000 * elapsed / max(1, len(solutions) * queries_per_board),
+            "answers": answers,
+        }
+
+    reference = results[SolverBackend.CPMPY.name.lower()]["answers"]
+    for name, result in results.items():
+        if result.pop("answers") != reference:
+            raise RuntimeError(f"Backend {name} disagrees with cpmpy!")
+
+    return results
+
+
+def benchmark_ken_codec(boards: int = 10000, seed: int = 0) -> dict:
+    # Encodes and decodes puzzle-like boards: random givens over full dot maps
+    grids = np.stack(load_grids())
+    grids = grids[np.random.default_rng(seed).integers(len(grids), size=boards)]
+    dots = dot_maps(grids)
+    givens = grids * (np.random.default_rng(seed).random(grids.shape) < 0.3)
+
+    start = time.perf_counter()
+    kens = [encode_ken(v, d) for v, d in zip(givens, dots)]
+    encode_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    decoded = [decode_ken_arrays(ken) for ken in kens]
+    decode_seconds = time.perf_counter() - start
+
+    if any((v != v2).any() or (d != d2).any() for v, d, (v2, d2) in zip(givens, dots, decoded)):
+        raise RuntimeError("KEN round trip failed!")
+
+    return {
+        "boards": boards,
+        "encode_per_second": boards / encode_seconds,
+        "decode_per_second": boards / decode_seconds,
+    }
+
+
+def benchmark_generation(solutions: list[np.ndarray], sampling: int, cost: SearchCost = DEFAULT_SEARCH_COST,
+                         mode: SearchMode = DEFAULT_SEARCH_MODE, seed: int = 0) -> dict:
+    """
+    Runs the stages of generate_kropki on every board, timing the seed search and the minimization
+    separately, along with the solver calls of each stage and the nodes expanded by the minimization.
+    """
+    seed_seconds, seed_calls, seed_givens = [], [], []
+    search_seconds, search_calls, expanded, puzzle_givens = [], [], [], []
+
+    for i, solution in enumerate(solutions):
+        oracle = UniquenessOracle(solution)
+
+        start = time.perf_counter()
+        start_mask = find_seed_guided(sampling, oracle, random.Random(seed + i))
+        seed_seconds.append(time.perf_counter() - start)
+        seed_calls.append(oracle.solver_calls)
+        seed_givens.append(start_mask.bit_count())
+
+        stats = SearchStats()
+        start = time.perf_counter()
+        mask, _ = minimize_mask(start_mask, oracle, stats=stats, cost=cost, mode=mode, on_improve=None)
+        search_seconds.append(time.perf_counter() - start)
+        search_calls.append(oracle.solver_calls - seed_calls[-1])
+        expanded.append(stats.expanded_nodes)
+        puzzle_givens.append(mask.bit_count())
+
+    return {
+        "seed_search": {
+            "seconds": summarize(seed_seconds),
+            "solver_calls": summarize(seed_calls),
+            "givens": summarize(seed_givens),
+        },
+        "minimization": {
+            "seconds": summarize(search_seconds),
+            "solver_calls": summarize(search_calls),
+            "expanded_nodes": summarize(expanded),
+            "givens": summarize(puzzle_givens),
+        },
+        "seconds_per_puzzle": (sum(seed_seconds) + sum(search_seconds)) / len(solutions),
+    }
+
+
+def benchmark_search(solutions: list[np.ndarray], sampling: int) -> dict:
+    # Every search cost and mode, from the same seeds
+    return {
+        f"{cost.name.lower()}/{mode.name.lower()}": benchmark_generation(solutions, sampling, cost, mode)
+        for cost in SearchCost
+        for mode in SearchMode
+    }
+
+
+def flatten(results: dict, prefix: str = "") -> dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+
+    return flat
+
+
+def compare_results(old: dict, new: dict) -> list[tuple[str, float, float]]:
+    # Metrics present in both runs, as (name, old value, new value)
+    old, new = flatten(old["results"]), flatten(new["results"])
+
+    return [(name, old[name], new[name]) for name in old if name in new]
+
+
+def print_generation(name: str, result: dict):
+    seed, search = result["seed_search"], result["minimization"]
+    print(f"{name}: {1000 * result['seconds_per_puzzle']:.1f} ms/puzzle | "
+          f"seed {1000 * seed['seconds']['mean']:.1f} ms, {seed['solver_calls']['mean']:.1f} solver calls | "
+          f"minimization {1000 * search['seconds']['mean']:.1f} ms, {search['solver_calls']['mean']:.1f} solver calls, "
+          f"{search['expanded_nodes']['mean']:.1f} expanded nodes (max {search['expanded_nodes']['max']:.0f}), "
+          f"{search['givens']['mean']:.1f} givens")
+
+
+def run_benchmark(args) -> dict:
+    if args.benchmark == "solver":
+        solutions = load_redis_solutions(args.boards) if args.redis else load_grids(args.boards)
+        results = benchmark_solver_backends(solutions, args.queries)
+
+        for name, result in results.items():
+            print(f"{name}: {result['per_query_ms']:.2f} ms/query ({result['queries']} queries)")
+
+        speedup = results["cpmpy"]["seconds"] / results["bitboard"]["seconds"]
+        print(f"bitboard speedup: {speedup:.1f}x")
+    elif args.benchmark == "ken":
+        results = benchmark_ken_codec(args.boards)
+        print(f"encode: {results['encode_per_second']:.0f} boards/s, decode: {results['decode_per_second']:.0f} boards/s")
+    elif args.benchmark == "search":
+        results = benchmark_search(load_grids(args.boards), args.sampling)
+
+        for name, result in results.items():
+            print_generation(name, result)
+    elif args.benchmark == "suite":
+        grids = load_grids(args.boards)
+        results = {
+            "generation": benchmark_generation(grids, args.sampling),
+            "oracle": benchmark_solver_backends(grids, args.queries),
+            "ken": benchmark_ken_codec(),
+        }
+
+        print_generation("generation", results["generation"])
+        for name, result in results["oracle"].items():
+            print(f"oracle {name}: {result['per_query_ms']:.2f} ms/query")
+        print(f"ken: encode {results['ken']['encode_per_second']:.0f} boards/s, "
+              f"decode {results['ken']['decode_per_second']:.0f} boards/s")
+    else:
+        raise ValueError(f"Unknown benchmark {args.benchmark}")
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kropki generator benchmarks")
+    parser.add_argument("--output", help="Save the results to this JSON file")
+    parser.add_argument("--profile", help="Run under cProfile and save the stats to this file")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    suite_parser = subparsers.add_parser("suite", help="Seed search, minimization, uniqueness oracle and KEN codec")
+    suite_parser.add_argument("--boards", type=int, default=10, help="Number of benchmark grids")
+    suite_parser.add_argument("--sampling", type=int, default=14, help="Givens sampled in the seed")
+    suite_parser.add_argument("--queries", type=int, default=50, help="Uniqueness queries per board")
+
+    solver_parser = subparsers.add_parser("solver", help="Compare uniqueness backends")
+    solver_parser.add_argument("--boards", type=int, default=10, help="Number of boards")
+    solver_parser.add_argument("--queries", type=int, default=50, help="Uniqueness queries per board")
+    solver_parser.add_argument("--redis", action="store_true", help="Take the boards from the `sudokus` set")
+
+    ken_parser = subparsers.add_parser("ken", help="KEN encode/decode throughput")
+    ken_parser.add_argument("--boards", type=int, default=10000, help="Number of boards")
+
+    search_parser = subparsers.add_parser("search", help="Compare minimization search costs and modes")
+    search_parser.add_argument("--boards", type=int, default=10, help="Number of benchmark grids")
+    search_parser.add_argument("--sampling", type=int, default=10, help="Givens sampled in the seed")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two saved runs")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+
+    args = parser.parse_args()
+
+    if args.benchmark == "compare":
+        with open(args.old) as f_old, open(args.new) as f_new:
+            for name, old, new in compare_results(json.load(f_old), json.load(f_new)):
+                change = f"{100 * (new - old) / old:+.1f}%" if old else "n/a"
+                print(f"{name}: {old:.4g} -> {new:.4g} ({change})")
+        return
+
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+
+    results = run_benchmark(args)
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "benchmark": args.benchmark,
+                "arguments": {k: v for k, v in vars(args).items() if k not in ("output", "profile", "benchmark")},
+                "python": platform.python_version(),
+                "timestamp": time.time(),
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+from typing import Iterable, Iterator
+
+import numpy as np
+
+# Given masks use bit `r * 9 + c` for cell (r, c), so that bit order matches row-major cell order
+FULL_MASK = (1 << 81) - 1
+
+# Dot maps are (2, 9, 9) arrays indexed by the top/left cell of each dot, in the same
+# (bottom, right) order used by KEN cells
+BOTTOM = 0
+RIGHT = 1
+
+DOT_NONE = 0
+DOT_WHITE = 1
+DOT_BLACK = 2
+
+
+def cell_bit(cell: tuple[int, int]) -> int:
+    r, c = cell
+    return 1 << (int(r) * 9 + int(c))
+
+
+def cells_to_mask(cells: Iterable[tuple[int, int]]) -> int:
+    mask = 0
+    for cell in cells:
+        mask |= cell_bit(cell)
+
+    return mask
+
+
+def mask_bits(mask: int) -> Iterator[int]:
+    """Yield the single-bit masks set in `mask`, lowest first."""
+    while mask:
+        bit = mask & -mask
+        yield bit
+        mask ^= bit
+
+
+def mask_cells(mask: int) -> Iterator[tuple[int, int]]:
+    for bit in mask_bits(mask):
+        yield divmod(bit.bit_length() - 1, 9)
+
+
+def mask_to_array(mask: int) -> np.ndarray:
+    return np.array([(mask >> i) & 1 for i in range(81)], dtype=bool).reshape(9, 9)
+
+
+def empty_dots() -> np.ndarray:
+    return np.zeros(shape=(2, 9, 9), dtype=np.uint8)
+
+
+def _dot_types(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # Black takes precedence: 1 and 2 are both consecutive and in a 1:2 ratio
+    black = (a == 2 * b) | (b == 2 * a)
+    white = np.abs(a - b) == 1
+
+    return np.where(black, DOT_BLACK, np.where(white, DOT_WHITE, DOT_NONE)).astype(np.uint8)
+
+
+def dot_maps(grids: np.ndarray) -> np.ndarray:
+    """
+    Dot maps of a full (9, 9) grid or of a (n, 9, 9) batch of full grids, computed in one pass
+    over all vertical and horizontal neighbor pairs. Returns a (2, 9, 9) or (n, 2, 9, 9) array.
+    """
+    grids = np.asarray(grids).astype(np.int16)
+    batch = grids.reshape(-1, 9, 9)
+
+    dots = np.zeros(shape=(len(batch), 2, 9, 9), dtype=np.uint8)
+    dots[:, BOTTOM, :-1, :] = _dot_types(batch[:, :-1, :], batch[:, 1:, :])
+    dots[:, RIGHT, :, :-1] = _dot_types(batch[:, :, :-1], batch[:, :, 1:])
+
+    return dots if grids.ndim == 3 else dots[0]
@@ -0,0 +1,71 @@
+from collections import OrderedDict
+from typing import Optional
+
+
+class UniquenessCache:
+    """
+    Bounded memo of uniqueness results for the given masks of a single solution.
+
+    Exact results are kept in an LRU map. On top of that, uniqueness is monotone in the givens:
+    any superset of a unique mask is unique and any subset of an ambiguous mask is ambiguous.
+    The smallest unique masks and the largest ambiguous masks seen so far are kept in two bounded
+    frontiers, which answer queries for masks that were never solved.
+    """
+
+    def __init__(self, maxsize: int = 4096, frontier_size: int = 256):
+        self.maxsize = maxsize
+        self.frontier_size = frontier_size
+
+        self.results: OrderedDict[int, bool] = OrderedDict()
+        self.unique_frontier: list[int] = []
+        self.ambiguous_frontier: list[int] = []
+
+        self.hits = 0
+        self.misses = 0
+        self.inferences = 0
+
+    def get(self, mask: int) -> Optional[bool]:
+        if mask in self.results:
+            self.results.move_to_end(mask)
+            self.hits += 1
+            return self.results[mask]
+
+        if any(unique & ~mask == 0 for unique in self.unique_frontier):
+            self.inferences += 1
+            return True
+
+        if any(mask & ~ambiguous == 0 for ambiguous in self.ambiguous_frontier):
+            self.inferences += 1
+            return False
+
+        self.misses += 1
+        return None
+
+    def has_unique_subset(self, mask: int) -> bool:
+        # Whether a strict subset of `mask` is known to be unique, i.e. `mask` is not minimal
+        return any(unique & ~mask == 0 and unique != mask for unique in self.unique_frontier)
+
+    def put(self, mask: int, unique: bool):
+        self.results[mask] = unique
+        self.results.move_to_end(mask)
+        if len(self.results) > self.maxsize:
+            self.results.popitem(last=False)
+
+        if unique:
+            self.unique_frontier = self._add_to_frontier(self.unique_frontier, mask, lambda a, b: a & ~b == 0)
+        else:
+            self.ambiguous_frontier = self._add_to_frontier(self.ambiguous_frontier, mask, lambda a, b: b & ~a == 0)
+
+    def _add_to_frontier(self, frontier: list[int], mask: int, implies) -> list[int]:
+        # `implies(a, b)` holds when knowing `a` is enough to answer for `b`
+        if any(implies(m, mask) for m in frontier):
+            return frontier
+
+        frontier = [m for m in frontier if not implies(mask, m)]
+        frontier.append(mask)
+
+        return frontier[-self.frontier_size:]
+
+    def __repr__(self):
+        return f"UniquenessCache(hits={self.hits}, misses={self.misses}, inferences={self.inferences}, " \
+               f"size={len(self.results)})"
@@ -0,0 +1,202 @@
+import argparse
+import hashlib
+import os
+from itertools import permutations, product
+
+import numpy as np
+import redis
+import redis.asyncio
+from loguru import logger
+
+from bitboard import BOTTOM, RIGHT, DOT_NONE
+from diversity import SOLUTIONS_KEY
+from inventory import STOCK_SAMPLINGS, STOCK_DIFFICULTIES, stock_key
+from ken import entries_to_grids
+from metrics import REDIS_SECONDS
+from packed import unpack_board, is_packed_board
+
+# Hashes of the canonical forms of every solution grid and puzzle generated so far
+GRID_HASHES_KEY = "kropki:canonical:grids"
+PUZZLE_HASHES_KEY = "kropki:canonical:puzzles"
+
+# Every reordering of the 9 rows (or columns) that keeps a grid valid: the 3 bands in any order,
+# and the 3 rows of each band in any order. (1296, 9)
+LINE_PERMUTATIONS = np.array([
+    [3 * band + row for band, inner in zip(bands, inners) for row in inner]
+    for bands in permutations(range(3))
+    for inners in product(permutations(range(3)), repeat=3)
+], dtype=np.intp)
+
+# The other two rows of the band of each row
+_BAND_MATES = np.array([[m for m in range(3 * (r // 3), 3 * (r // 3) + 3) if m != r] for r in range(9)])
+_ROW_WEIGHTS = 10 ** np.arange(8, -1, -1, dtype=np.int64)
+
+
+def _row_keys_to_grid(keys: np.ndarray) -> np.ndarray:
+    return (keys[:, None] // _ROW_WEIGHTS % 10).astype(np.uint8)
+
+
+def _relabeled_row_keys(orientations: np.ndarray, o: np.ndarray, first: np.ndarray, p: np.ndarray,
+                        rows: np.ndarray) -> np.ndarray:
+    # (n, k) keys of the `rows` of each candidate once its columns are reordered by LINE_PERMUTATIONS[p]
+    # and its digits relabeled so that its `first` row reads 123456789
+    n = len(o)
+    columns = LINE_PERMUTATIONS[p]
+
+    labels = np.zeros(shape=(n, 10), dtype=np.intp)
+    labels[np.arange(n)[:, None], orientations[o[:, None], first[:, None], columns]] = np.arange(1, 10)
+
+    values = orientations[o[:, None, None], rows[:, :, None], columns[:, None, :]]
+    values = np.take_along_axis(labels, values.reshape(n, -1), axis=1).reshape(values.shape)
+
+    return values @ _ROW_WEIGHTS
+
+
+def canonical_grid(grid: np.ndarray) -> np.ndarray:
+    """
+    Canonical form of a full grid under the Sudoku symmetries: digit relabeling, band and stack
+    permutations, row and column permutations inside them, and transposition.
+
+    The canonical grid is the lexicographically smallest equivalent one. Its first row is always
+    123456789, so only the choices of the first row (18, counting transposition) and of the column
+    order (1296) need to be enumerated: each fixes the digit labels, and the remaining rows are then
+    best sorted inside their bands, with bands sorted by their first row. The first band decides
+    between most candidates, so the other rows are only computed for the candidates it keeps.
+    """
+    grid = np.asarray(grid, dtype=np.intp)
+    orientations = np.stack([grid, grid.T])
+
+    o, first, p = (a.ravel() for a in np.meshgrid(np.arange(2), np.arange(9), np.arange(len(LINE_PERMUTATIONS)),
+                                                   indexing="ij"))
+
+    # The first row has the smallest possible key, so it comes first in its band and its band comes first
+    mates = np.sort(_relabeled_row_keys(orientations, o, first, p, _BAND_MATES[first]), axis=1)
+    kept = (mates == mates[np.lexsort(mates.T[::-1])[0]]).all(axis=1)
+    o, first, p = o[kept], first[kept], p[kept]
+
+    rows = np.broadcast_to(np.arange(9), (len(o), 9))
+    keys = np.sort(_relabeled_row_keys(orientations, o, first, p, rows).reshape(-1, 3, 3), axis=2)
+    keys = np.take_along_axis(keys, np.argsort(keys[:, :, 0], axis=1)[:, :, None], axis=1).reshape(-1, 9)
+
+    best = np.lexsort(keys.T[::-1])[0]
+
+    return _row_keys_to_grid(keys[best])
+
+
+def _transpose_puzzle(values: np.ndarray, dots: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # Bottom dots become right dots and vice versa
+    return values.T, dots[[RIGHT, BOTTOM]].transpose(0, 2, 1)
+
+
+def _flip_puzzle_columns(values: np.ndarray, dots: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    flipped = np.full_like(dots, DOT_NONE)
+    flipped[BOTTOM] = dots[BOTTOM, :, ::-1]
+    flipped[RIGHT, :, :-1] = dots[RIGHT, :, -2::-1]
+
+    return values[:, ::-1], flipped
+
+
+def _flip_puzzle_rows(values: np.ndarray, dots: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    flipped = np.full_like(dots, DOT_NONE)
+    flipped[RIGHT] = dots[RIGHT, ::-1]
+    flipped[BOTTOM, :-1] = dots[BOTTOM, -2::-1]
+
+    return values[::-1], flipped
+
+
+def puzzle_symmetries(values: np.ndarray, dots: np.ndarray) -> list[tuple[np.ndarray, np.ndarray]]:
+    """
+    The 8 rotations and reflections of a puzzle, as (values, dots) pairs, starting from the puzzle itself.
+    They are the only Sudoku symmetries that keep neighboring cells next to each other, and no digit
+    relabeling but the identity keeps every black dot a 1:2 ratio.
+    """
+    variants = [(np.asarray(values), np.asarray(dots))]
+    for transform in (_transpose_puzzle, _flip_puzzle_columns, _flip_puzzle_rows):
+        variants += [transform(*variant) for variant in variants]
+
+    return variants
+
+
+def canonical_puzzle(values: np.ndarray, dots: np.ndarray) -> bytes:
+    # Smallest byte string among the symmetries of the given values (0 for blank cells) and the dots
+    return min(
+        np.ascontiguousarray(v, dtype=np.uint8).tobytes() + np.ascontiguousarray(d, dtype=np.uint8).tobytes()
+        for v, d in puzzle_symmetries(values, dots)
+    )
+
+
+def _digest(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def grid_hash(grid: np.ndarray) -> bytes:
+    return _digest(canonical_grid(grid).tobytes())
+
+
+def puzzle_hash(puzzle: bytes) -> bytes:
+    digits, givens, dots = unpack_board(puzzle)
+
+    return _digest(canonical_puzzle(np.where(givens, digits, 0), dots))
+
+
+def add_grid(r: redis.Redis, grid: np.ndarray) -> bool:
+    # Indexes a grid, returning False if an equivalent one already was
+    key = grid_hash(grid)
+    with REDIS_SECONDS.labels(operation="add_grid").time():
+        return bool(r.sadd(GRID_HASHES_KEY, key))
+
+
+def add_puzzle(r: redis.Redis, puzzle: bytes) -> bool:
+    # Indexes a packed puzzle, returning False if an equivalent one already was
+    key = puzzle_hash(puzzle)
+    with REDIS_SECONDS.labels(operation="add_puzzle").time():
+        return bool(r.sadd(PUZZLE_HASHES_KEY, key))
+
+
+async def add_puzzles_async(r: redis.asyncio.Redis, puzzles: list[bytes]) -> list[bool]:
+    # add_puzzle for every puzzle, in a single round-trip
+    keys = [puzzle_hash(puzzle) for puzzle in puzzles]
+
+    with REDIS_SECONDS.labels(operation="add_puzzle").time():
+        pipeline = r.pipeline(transaction=False)
+        for key in keys:
+            pipeline.sadd(PUZZLE_HASHES_KEY, key)
+
+        return [bool(added) for added in await pipeline.execute()]
+
+
+def index_existing(r: redis.Redis) -> tuple[int, int]:
+    """
+    Indexes the solutions in the `sudokus` set and the puzzles in stock, for the boards generated before
+    the index existed. Returns the number of equivalent solutions and puzzles found along the way.
+    """
+    duplicate_grids = 0
+    for grid in entries_to_grids(list(r.sscan_iter(SOLUTIONS_KEY, count=1000))):
+        duplicate_grids += not add_grid(r, grid)
+
+    duplicate_puzzles = 0
+    for sampling in STOCK_SAMPLINGS:
+        for difficulty in STOCK_DIFFICULTIES:
+            for puzzle in r.lrange(stock_key(sampling, difficulty), 0, -1):
+                # Stock entries from before packed records carry no solution to index
+                if is_packed_board(puzzle):
+                    duplicate_puzzles += not add_puzzle(r, puzzle)
+
+    return duplicate_grids, duplicate_puzzles
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Canonical form index of generated boards")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("index", help="Index the stored solutions and the puzzle stock")
+
+    args = parser.parse_args()
+
+    if args.command == "index":
+        duplicate_grids, duplicate_puzzles = index_existing(redis.from_url(os.getenv("REDIS_KEYS_URL")))
+        logger.info("Indexed stored boards: {} equivalent solutions, {} equivalent puzzles",
+                    duplicate_grids, duplicate_puzzles)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+import argparse
+import os
+import random
+import time
+from typing import Optional
+
+import numpy as np
+import redis
+from loguru import logger
+
+from inventory import STOCK_SAMPLINGS, STOCK_DIFFICULTIES, RatedPuzzle, stock_key
+from packed import BOARD_DTYPE, is_packed_board
+from rating import Difficulty, rate_board
+
+# Local corpus served before the Redis stock, e.g. a pre-built file shipped in the image
+CORPUS_PATH = os.getenv("KROPKI_CORPUS_PATH")
+# Seconds between checks for records appended by workers
+CORPUS_REFRESH_INTERVAL = float(os.getenv("KROPKI_CORPUS_REFRESH_INTERVAL", 30))
+
+# A corpus file is a 16-byte header followed by fixed-size records, so that record `i` sits at
+# HEADER_SIZE + i * RECORD_SIZE. Difficulty holds a rating.Difficulty value, and sampling 0 stands for
+# padding records which are never served.
+CORPUS_MAGIC = b"KRPC"
+CORPUS_VERSION = 1
+HEADER_DTYPE = np.dtype([
+    ("magic", "S4"),
+    ("version", "<u2"),
+    ("record_size", "<u2"),
+    ("reserved", np.uint8, 8),
+])
+HEADER_SIZE = HEADER_DTYPE.itemsize
+
+RECORD_DTYPE = np.dtype([
+    ("board", BOARD_DTYPE),
+    ("sampling", np.uint8),
+    ("difficulty", np.uint8),
+])
+RECORD_SIZE = RECORD_DTYPE.itemsize
+
+# Index keys are (sampling, given count, difficulty)
+IndexKey = tuple[int, int, int]
+
+
+def corpus_header() -> bytes:
+    header = np.zeros(shape=1, dtype=HEADER_DTYPE)
+    header["magic"] = CORPUS_MAGIC
+    header["version"] = CORPUS_VERSION
+    header["record_size"] = RECORD_SIZE
+
+    return header.tobytes()
+
+
+def check_header(path: str, data: bytes):
+    header = np.frombuffer(data, dtype=HEADER_DTYPE)[0]
+
+    if header["magic"] != CORPUS_MAGIC:
+        raise ValueError(f"{path} is not a kropki corpus!")
+    if header["version"] != CORPUS_VERSION or header["record_size"] != RECORD_SIZE:
+        raise ValueError(f"Unsupported corpus version {header['version']} in {path}!")
+
+
+def make_records(boards: np.ndarray, sampling: int, difficulty: int = 0) -> np.ndarray:
+    records = np.zeros(shape=len(boards), dtype=RECORD_DTYPE)
+    records["board"] = boards
+    records["sampling"] = sampling
+    records["difficulty"] = difficulty
+
+    return records
+
+
+def given_counts(records: np.ndarray) -> np.ndarray:
+    return np.unpackbits(records["board"]["givens"], axis=1).sum(axis=1)
+
+
+def index_keys(records: np.ndarray) -> np.ndarray:
+    # Packs (sampling, given count, difficulty) into a single sortable integer per record
+    return (records["sampling"].astype(np.uint32) << 16) | (given_counts(records).astype(np.uint32) << 8) \
+        | records["difficulty"]
+
+
+def unpack_key(key: int) -> IndexKey:
+    return (key >> 16) & 0xFF, (key >> 8) & 0xFF, key & 0xFF
+
+
+class Corpus:
+    """
+    Read-only, memory-mapped view of a corpus file.
+
+    Records are indexed by (sampling, given count, difficulty); picking a random record for an
+    exact key is O(1). Records appended to the file after it was opened show up on `refresh`, and
+    so does a compacted file moved in place; a partially written record at the end of the file is
+    ignored until it is complete.
+    """
+
+    def __init__(self, path: str, rng: Optional[random.Random] = None, refresh_interval: float = CORPUS_REFRESH_INTERVAL):
+        self.path = path
+        self.rng = rng or random.Random()
+        self.refresh_interval = refresh_interval
+
+        self.records = np.zeros(shape=0, dtype=RECORD_DTYPE)
+        self.index: dict[IndexKey, np.ndarray] = {}
+        self.inode = None
+        self.refreshed_at = 0.0
+
+        self.refresh()
+
+    def __len__(self):
+        return len(self.records)
+
+    def refresh(self) -> int:
+        # Returns the number of new records
+        self.refreshed_at = time.monotonic()
+        stat = os.stat(self.path)
+
+        if stat.st_ino != self.inode:
+            with open(self.path, "rb") as f:
+                check_header(self.path, f.read(HEADER_SIZE))
+
+            self.inode = stat.st_ino
+            self.records = np.zeros(shape=0, dtype=RECORD_DTYPE)
+            self.index = {}
+
+        count = (stat.st_size - HEADER_SIZE) // RECORD_SIZE
+        if count <= len(self.records):
+            return 0
+
+        previous = len(self.records)
+        self.records = np.memmap(self.path, dtype=RECORD_DTYPE, mode="r", offset=HEADER_SIZE, shape=(count,))
+        self._build_index()
+
+        return count - previous
+
+    def refresh_if_stale(self) -> int:
+        if time.monotonic() - self.refreshed_at < self.refresh_interval:
+            return 0
+
+        return self.refresh()
+
+    def _build_index(self):
+        keys = index_keys(self.records)
+        order = np.argsort(keys, kind="stable")
+        order = order[self.records["sampling"][order] != 0]
+        unique_keys, starts = np.unique(keys[order], return_index=True)
+
+        self.index = {
+            unpack_key(int(key)): indices
+            for key, indices in zip(unique_keys, np.split(order, starts[1:]))
+        }
+
+    def matching(self, sampling: Optional[int] = None, given_count: Optional[int] = None,
+                 difficulty: Optional[int] = None) -> list[np.ndarray]:
+        # Index buckets matching every criterion that is not None
+        wanted = (sampling, given_count, difficulty)
+
+        return [
+            indices for key, indices in self.index.items()
+            if all(w is None or w == k for w, k in zip(wanted, key))
+        ]
+
+    def count(self, sampling: Optional[int] = None, given_count: Optional[int] = None,
+              difficulty: Optional[int] = None) -> int:
+        return sum(len(indices) for indices in self.matching(sampling, given_count, difficulty))
+
+    def pick(self, sampling: Optional[int] = None, given_count: Optional[int] = None,
+             difficulty: Optional[int] = None) -> Optional[RatedPuzzle]:
+        """Returns the packed board and difficulty of a uniformly random matching record, or None if there is none."""
+        buckets = self.matching(sampling, given_count, difficulty)
+
+        i = self.rng.randrange(sum(map(len, buckets))) if buckets else None
+        for indices in buckets:
+            if i < len(indices):
+                record = self.records[indices[i]]
+                return record["board"].tobytes(), Difficulty(int(record["difficulty"]))
+
+            i -= len(indices)
+
+        return None
+
+
+class CorpusWriter:
+    """
+    Append-only corpus writer.
+
+    Every record is written with a single `write` on a file opened with O_APPEND, so that several
+    worker processes can append to the same file and readers never see interleaved records.
+    The file is reopened when a compaction moves a new one in place; records appended while the
+    compaction runs are lost.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        # Only the process that creates the file writes the header
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            os.write(fd, corpus_header())
+            os.close(fd)
+        except FileExistsError:
+            with open(path, "rb") as f:
+                check_header(path, f.read(HEADER_SIZE))
+
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+
+    def _align(self):
+        # A record torn by a crashed writer would shift every following one: pad it into a whole record
+        torn = (os.fstat(self.fd).st_size - HEADER_SIZE) % RECORD_SIZE
+        if torn:
+            os.write(self.fd, bytes(RECORD_SIZE - torn))
+
+    def append(self, board: bytes, sampling: int, difficulty: int = 0):
+        if os.stat(self.path).st_ino != os.fstat(self.fd).st_ino:
+            os.close(self.fd)
+            self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+
+        self._align()
+
+        record = make_records(np.frombuffer(board, dtype=BOARD_DTYPE), sampling, difficulty)
+        os.write(self.fd, record.tobytes())
+
+    def close(self):
+        os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def write_corpus(path: str, records: np.ndarray):
+    # Writes a whole corpus next to `path` and atomically moves it in place
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(corpus_header())
+        f.write(records.tobytes())
+
+    os.replace(tmp_path, path)
+
+
+def compact_corpus(source: str, destination: Optional[str] = None) -> tuple[int, int]:
+    """
+    Drops duplicate boards (keeping the latest record of each), padding records and any truncated
+    trailing record, and sorts records by index key so that each bucket is contiguous on disk.
+    Returns the number of records before and after compaction.
+    """
+    corpus = Corpus(source)
+    records = np.array(corpus.records)
+    records = records[records["sampling"] != 0]
+
+    # np.unique keeps the first occurrence, so look at the records from the newest
+    _, latest = np.unique(records["board"][::-1].view(np.dtype((np.void, BOARD_DTYPE.itemsize))),
+                          return_index=True)
+    records = records[::-1][latest]
+    records = records[np.argsort(index_keys(records), kind="stable")]
+
+    write_corpus(destination or source, records)
+
+    return len(corpus), len(records)
+
+
+def rate_corpus(path: str) -> int:
+    # Rates the records stored before puzzles had a difficulty, rewriting the corpus
+    records = np.array(Corpus(path).records)
+    unrated = np.flatnonzero((records["difficulty"] == Difficulty.UNRATED) & (records["sampling"] != 0))
+
+    for i in unrated:
+        records["difficulty"][i] = rate_board(records["board"][i].tobytes())
+
+    write_corpus(path, records)
+
+    return len(unrated)
+
+
+def export_stock(r: redis.Redis, path: str) -> int:
+    # Appends the puzzles currently in the Redis stock to a corpus, without consuming them
+    exported = 0
+    with CorpusWriter(path) as writer:
+        for sampling in STOCK_SAMPLINGS:
+            for difficulty in STOCK_DIFFICULTIES:
+                for puzzle in r.lrange(stock_key(sampling, difficulty), 0, -1):
+                    # Stock entries from before packed records cannot be stored in a corpus
+                    if is_packed_board(puzzle):
+                        writer.append(puzzle, sampling, difficulty)
+                        exported += 1
+
+    return exported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kropki puzzle corpus tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compact_parser = subparsers.add_parser("compact", help="Deduplicate and sort a corpus")
+    compact_parser.add_argument("source")
+    compact_parser.add_argument("destination", nargs="?", help="Defaults to rewriting the source in place")
+
+    export_parser = subparsers.add_parser("export", help="Append the Redis puzzle stock to a corpus")
+    export_parser.add_argument("path")
+
+    rate_parser = subparsers.add_parser("rate", help="Rate the unrated puzzles of a corpus")
+    rate_parser.add_argument("path")
+
+    stats_parser = subparsers.add_parser("stats", help="Print the number of records per index key")
+    stats_parser.add_argument("path")
+
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        before, after = compact_corpus(args.source, args.destination)
+        logger.info("Compacted {} records into {}", before, after)
+    elif args.command == "export":
+        exported = export_stock(redis.from_url(os.getenv("REDIS_KEYS_URL")), args.path)
+        logger.info("Exported {} puzzles to {}", exported, args.path)
+    elif args.command == "rate":
+        rated = rate_corpus(args.path)
+        logger.info("Rated {} puzzles in {}", rated, args.path)
+    elif args.command == "stats":
+        corpus = Corpus(args.path)
+        for (sampling, given_count, difficulty), indices in sorted(corpus.index.items()):
+            print(f"sampling={sampling} givens={given_count} difficulty={Difficulty(difficulty).name.lower()}: "
+                  f"{len(indices)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+
+from generator import SearchMode
+from graph import SearchBudget
+from inventory import make_rated_puzzles, RatedPuzzle
+from metrics import DISPATCHER_PENDING, DISPATCHER_REJECTED, process_exited
+from ken import retrieve_kropki_solution
+from rating import Difficulty
+
+GENERATION_WORKERS = int(os.getenv("KROPKI_GENERATION_WORKERS", os.cpu_count()))
+GENERATION_QUEUE_SIZE = int(os.getenv("KROPKI_GENERATION_QUEUE_SIZE", 2 * GENERATION_WORKERS))
+GENERATION_TIMEOUT = float(os.getenv("KROPKI_GENERATION_TIMEOUT", 60))
+# Requests wait for inline generation, so it trades the A* search for a faster one by default
+INLINE_SEARCH_MODE = SearchMode[os.getenv("KROPKI_INLINE_SEARCH_MODE", "greedy").upper()]
+# Seconds a request's generation may search before settling for the best puzzle found so far
+INLINE_SEARCH_SECONDS = float(os.getenv("KROPKI_INLINE_SEARCH_SECONDS", 10))
+
+
+class DispatcherSaturated(Exception):
+    pass
+
+
+def generate_puzzle(sampling: int, solution: Optional[np.ndarray] = None,
+                    difficulty: Optional[Difficulty] = None) -> list[RatedPuzzle]:
+    # With a target difficulty, puzzles are made from the same solution until one matches; the
+    # closest one comes last and the others are meant to be stocked
+    if solution is None:
+        solution = retrieve_kropki_solution()
+
+    # A single budget for every attempt, so that looking for a difficulty does not multiply the latency
+    return make_rated_puzzles(solution, sampling, difficulty, INLINE_SEARCH_MODE,
+                              SearchBudget(seconds=INLINE_SEARCH_SECONDS))
+
+
+class GenerationDispatcher:
+    """
+    Runs inline puzzle generation on a bounded process pool, off the event loop.
+
+    At most `max_pending` generations are queued or running at any time; past that, `generate`
+    raises `DispatcherSaturated` right away instead of queueing more CPU-heavy work.
+    Every request gets a generation of its own, so that concurrent clients never receive the same puzzle.
+    """
+
+    def __init__(self, max_workers: int = GENERATION_WORKERS, max_pending: int = GENERATION_QUEUE_SIZE,
+                 timeout: float = GENERATION_TIMEOUT):
+        self.executor = ProcessPoolExecutor(max_workers=max_workers)
+        self.max_pending = max_pending
+        self.timeout = timeout
+
+        self.pending = 0
+
+    @property
+    def available(self) -> int:
+        return max(0, self.max_pending - self.pending)
+
+    def _start(self, sampling: int, solution: Optional[np.ndarray], difficulty: Optional[Difficulty]) -> asyncio.Future:
+        if self.pending >= self.max_pending:
+            DISPATCHER_REJECTED.inc()
+            raise DispatcherSaturated()
+
+        future = asyncio.get_running_loop().run_in_executor(
+            self.executor, generate_puzzle, sampling, solution, difficulty
+        )
+        self.pending += 1
+        DISPATCHER_PENDING.inc()
+
+        def on_done(_):
+            # A timed out generation still occupies its worker, so it is only released here
+            self.pending -= 1
+            DISPATCHER_PENDING.dec()
+
+        future.add_done_callback(on_done)
+
+        return future
+
+    def submit(self, sampling: int, solution: Optional[np.ndarray] = None,
+               difficulty: Optional[Difficulty] = None) -> asyncio.Task:
+        # Starts a generation right away, unlike `generate` which only does when awaited
+        future = self._start(sampling, solution, difficulty)
+
+        # Shielded, so that a timed out client does not release the slot of a generation still running
+        return asyncio.ensure_future(asyncio.wait_for(asyncio.shield(future), self.timeout))
+
+    async def generate(self, sampling: int, solution: Optional[np.ndarray] = None,
+                       difficulty: Optional[Difficulty] = None) -> list[RatedPuzzle]:
+        return await self.submit(sampling, solution, difficulty)
+
+    def shutdown(self):
+        pids = list(self.executor._processes or {})
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+        for pid in pids:
+            process_exited(pid)
@@ -0,0 +1,107 @@
+import os
+import random
+from typing import Optional
+
+import numpy as np
+import redis
+
+from ken import entries_to_grids
+from metrics import REDIS_SECONDS
+
+SOLUTIONS_KEY = "sudokus"
+# Stream of the members added to `sudokus`, so that readers can fetch only what is new. It is capped,
+# and readers that fall behind by more than its length scan the whole set again
+SOLUTIONS_STREAM_KEY = "sudokus:stream"
+SOLUTIONS_STREAM_LENGTH = int(os.getenv("KROPKI_SOLUTIONS_STREAM_LENGTH", 10000))
+
+DIVERSITY_SAMPLE_SIZE = int(os.getenv("KROPKI_DIVERSITY_SAMPLE_SIZE", 32))
+DIVERSITY_CANDIDATES = int(os.getenv("KROPKI_DIVERSITY_CANDIDATES", 64))
+
+
+def most_diverse(candidates: np.ndarray, sample: list[np.ndarray]) -> int:
+    # Index of the candidate whose closest sample solution differs from it in the most cells
+    if not sample:
+        return 0
+
+    distances = (candidates.reshape(-1, 1, 81) != np.stack(sample).reshape(1, -1, 81)).sum(axis=2)
+    closest = distances.min(axis=1)
+
+    return int(np.argmax(closest * 81 * len(sample) + distances.sum(axis=1)))
+
+
+@REDIS_SECONDS.labels(operation="add_solution").time()
+def add_solution(r: redis.Redis, entry: bytes | str) -> bool:
+    # Entries are packed board records, older ones are KEN strings
+    added = r.sadd(SOLUTIONS_KEY, entry)
+    if added:
+        r.xadd(SOLUTIONS_STREAM_KEY, {"entry": entry}, maxlen=SOLUTIONS_STREAM_LENGTH, approximate=True)
+
+    return bool(added)
+
+
+def solution_stream_position(r: redis.Redis) -> tuple[int, int, bytes]:
+    # Entries ever added to the stream, entries still in it, and the id of the last one
+    try:
+        info = r.xinfo_stream(SOLUTIONS_STREAM_KEY)
+    except redis.ResponseError:
+        # No solution added yet
+        return 0, 0, b"0-0"
+
+    return info["entries-added"], info["length"], info["last-generated-id"]
+
+
+class SolutionStore:
+    """
+    Reservoir sample of the `sudokus` set, kept up to date incrementally.
+
+    The first refresh scans the whole set; later ones only read the `sudokus:stream` entries past the
+    last one read, unless the stream was trimmed past it in the meantime. Only `sample_size` decoded
+    solutions are kept, so that diversity is scored against a bounded, uniformly drawn subset of the
+    stored boards instead of every one of them.
+    """
+
+    def __init__(self, sample_size: int = DIVERSITY_SAMPLE_SIZE, rng: Optional[random.Random] = None):
+        self.sample_size = sample_size
+        self.rng = rng or random.Random()
+
+        self.size = 0
+        self.sample: list[np.ndarray] = []
+        self.last_id: Optional[bytes] = None
+        self.entries_read = 0
+
+    def __len__(self):
+        return self.size
+
+    def refresh(self, r: redis.Redis) -> int:
+        # Returns the number of new solutions
+        entries_added, length, last_id = solution_stream_position(r)
+        size = self.size
+
+        scanned = []
+        if self.last_id is None or entries_added - self.entries_read > length:
+            # Read the stream position first: anything added while scanning is read again from the stream
+            self.size = 0
+            self.sample = []
+            self.last_id, self.entries_read = last_id, entries_added
+            scanned = list(r.sscan_iter(SOLUTIONS_KEY, count=1000))
+
+        streamed = r.xrange(SOLUTIONS_STREAM_KEY, min=b"(" + self.last_id)
+        if streamed:
+            self.last_id = streamed[-1][0]
+            self.entries_read += len(streamed)
+
+        new_entries = list(dict.fromkeys(scanned + [fields[b"entry"] for _, fields in streamed]))
+        for solution in entries_to_grids(new_entries):
+            self._add_to_sample(solution)
+
+        return max(0, self.size - size)
+
+    def _add_to_sample(self, solution: np.ndarray):
+        # Reservoir sampling over every solution seen so far
+        self.size += 1
+        seen = self.size
+
+        if len(self.sample) < self.sample_size:
+            self.sample.append(solution)
+        elif (i := self.rng.randrange(seen)) < self.sample_size:
+            self.sample[i] = solution
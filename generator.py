@@ -1,17 +1,30 @@
+import random
 from abc import ABC
 from abc import ABC
 from enum import Enum, auto
 from functools import total_ordering
 from itertools import product, combinations
-from typing import Iterable, Any
+from typing import Iterable, Any, Optional, Callable, TYPE_CHECKING
 
+import cpmpy as cp
+import numpy as np
 from cpmpy.expressions.core import Expression
 
-from graph import a_star
+from cache import UniquenessCache
+from bitboard import FULL_MASK, BOTTOM, RIGHT, DOT_WHITE, DOT_BLACK, cell_bit, cells_to_mask, mask_bits, \
+    mask_cells, mask_to_array, empty_dots, dot_maps
+from graph import a_star, best_first, beam_search, SearchStats, SearchBudget, BudgetExhausted
+from metrics import SOLVER_SECONDS, SEARCH_EXPANDED_NODES, SEARCH_BUDGET_EXHAUSTED
 from model import build_kropki_base_model
+from solver import KropkiSolver, count_solutions
 
 import redis
 import os
+from loguru import logger
+
+if TYPE_CHECKING:
+    from parallel import OraclePool
+
 
 @total_ordering
 class Constraint(ABC):
@@ -43,7 +56,7 @@ class CellConstraint(Constraint):
         return self.value == o.value and self.cell == o.cell
 
     def __hash__(self) -> int:
-        return hash(repr(self))
+        return hash((self.cell, self.value))
 
     def __contains__(self, item):
         return item == self.cell
@@ -77,7 +90,7 @@ class DotConstraint(Constraint):
         return self.dot_type == o.dot_type and self._cells == o._cells
 
     def __hash__(self) -> int:
-        return hash(repr(self))
+        return hash((self._cells, self.dot_type))
 
     def __str__(self):
         return f"DotConstraint(cells={self._cells}, type={self.dot_type})"
@@ -96,57 +109,86 @@ def get_constrained_cells(constraint_set: Iterable[Constraint]):
     return constrained_cells
 
 
-def prefixed_sequence_generator(prefix: list[tuple[int, int]]):
-    def sequence():
-        grid = grid_coords() - set(prefix)
+def constraints_to_mask(constraint_set: Iterable[Constraint]) -> int:
+    return cells_to_mask(c.cell for c in constraint_set if type(c) is CellConstraint)
+
+
+def mask_to_constraints(mask: int, solution) -> set[CellConstraint]:
+    return {CellConstraint(cell, solution[cell]) for cell in mask_cells(mask)}
+
+
+def constraints_to_dots(constraint_set: Iterable[Constraint]) -> np.ndarray:
+    dots = empty_dots()
+
+    for constraint in constraint_set:
+        if type(constraint) is DotConstraint:
+            r1, c1 = constraint.reference_cell()
+            r2, c2 = max(constraint.cells())
+            direction = RIGHT if r1 == r2 else BOTTOM
+            dots[direction, r1, c1] = DOT_BLACK if constraint.dot_type == DotType.BLACK else DOT_WHITE
+
+    return dots
+
+
+def dots_to_constraints(dots: np.ndarray) -> set[DotConstraint]:
+    dot_constraints = set()
 
-        yield from prefix
-        yield from grid
+    for direction, r, c in zip(*np.nonzero(dots)):
+        other_cell = (r + 1, c) if direction == BOTTOM else (r, c + 1)
+        dot_type = DotType.BLACK if dots[direction, r, c] == DOT_BLACK else DotType.WHITE
+        dot_constraints.add(DotConstraint({(int(r), int(c)), (int(other_cell[0]), int(other_cell[1]))}, dot_type))
 
-    return sequence
+    return dot_constraints
 
 
-def get_last_chosen_cell_index(constraint_set: frozenset[Constraint], start_node: frozenset[Constraint]) -> int:
-    chosen_cells, _ = partition_cells(constraint_set, start_node)
-    return len(chosen_cells)
+# Search nodes are given masks. Neighbors remove a single given, and givens are removed in increasing
+# cell order (start holes first), so that every subset of the start givens is reached by only one path.
 
+def get_candidate_mask(mask: int, start_mask: int) -> int:
+    # Givens that can still be removed: the ones after the last removed given
+    removed = start_mask & ~mask
+    if not removed:
+        return start_mask
 
-def partition_cells(constraint_set: frozenset[Constraint], start_node: frozenset[Constraint]) -> \
-        tuple[list[tuple[int, int]], list[tuple[int, int]]]:
-    start_holes = grid_coords() - set(c.reference_cell() for c in start_node if type(c) is CellConstraint)
-    sequence_generator = prefixed_sequence_generator(sorted(list(start_holes)))
+    last_removed = removed.bit_length()
+    return (start_mask >> last_removed) << last_removed
 
-    constrained_cells = {c.reference_cell(): c for c in constraint_set if type(c) is CellConstraint}
-    holes = grid_coords() - constrained_cells.keys()
 
-    last_chosen_cell = None
-    chosen_cells = []
-    possibly_chosen = []
-    for c in sequence_generator():
-        possibly_chosen.append(c)
-        if c in holes:
-            last_chosen_cell = c
-            chosen_cells += possibly_chosen
-            possibly_chosen = []
-    candidate_cells = possibly_chosen
+def get_required_removals(mask: int, start_mask: int, oracle: "UniquenessOracle") -> int:
+    # Candidates that every minimal given set below `mask` has removed. The givens before the last
+    # removed one are kept on every path below, so if they make the board unique every candidate
+    # has to go, and otherwise so do the candidates they imply by propagation
+    candidates = get_candidate_mask(mask, start_mask)
+    fixed = mask & ~candidates
 
-    if len(holes) > 0:
-        assert chosen_cells[-1] == last_chosen_cell
+    if oracle.is_unique(fixed):
+        return candidates
 
-    assert len(chosen_cells) + len(candidate_cells) == len(grid_coords())
+    return oracle.implied_givens(fixed, candidates)
 
-    return chosen_cells, candidate_cells
 
+def get_neighbor_masks(mask: int, start_mask: int, oracle: "UniquenessOracle",
+                       pool: Optional["OraclePool"] = None) -> list[int]:
+    candidates = get_candidate_mask(mask, start_mask)
 
-def get_neighbor_constraints_set(constraint_set: frozenset[Constraint], start_node: frozenset[Constraint]) -> \
-        frozenset[
-            frozenset[Constraint]]:
-    constrained_cells = {c.reference_cell(): c for c in constraint_set if type(c) is CellConstraint}
-    _, candidate_cells = partition_cells(constraint_set, start_node)
+    # Paths skipping past a required removal never reach a minimal set, and removing it keeps the board unique
+    required = get_required_removals(mask, start_mask, oracle)
+    if required:
+        first_required = required & -required
+        candidates &= first_required - 1
+    else:
+        first_required = 0
 
-    neighbor_constraint_sets = {constraint_set - {constrained_cells[c]} for c in candidate_cells}
+    neighbors = [mask & ~bit for bit in mask_bits(candidates)]
+
+    # Removing givens can never turn an ambiguous board into a unique one, so there is no point
+    # in exploring neighbors that already have multiple solutions
+    if pool is not None:
+        neighbors = pool.filter_unique(neighbors, oracle)
+    else:
+        neighbors = [n for n in neighbors if oracle.get_number_of_solutions(n) == 1]
 
-    return frozenset(neighbor_constraint_sets)
+    return neighbors + [mask & ~first_required] if first_required else neighbors
 
 
 def constraint_to_model(grid, constraint: Constraint) -> Expression:
@@ -174,10 +216,13 @@ def constraint_to_model(grid, constraint: Constraint) -> Expression:
         raise ValueError("Invalid constraint type")
 
 
-def is_minimal_constraint_set(constraints_set: set[Constraint]):
+def is_minimal_constraint_set(constraints_set: set[Constraint], oracle: Optional["UniquenessOracle"] = None):
     # Check whether the constraint set is minimal, i.e. removing any further constraint
     # would allow multiple solutions
 
+    if oracle is not None:
+        return is_minimal_mask(constraints_to_mask(constraints_set), oracle)
+
     value_constraints = set(filter(lambda c: type(c) is CellConstraint, constraints_set))
 
     for constraint in value_constraints:
@@ -192,7 +237,137 @@ def is_minimal_constraint_set(constraints_set: set[Constraint]):
     return True
 
 
-def get_number_of_solutions(constraints_set):
+def is_minimal_mask(mask: int, oracle: "UniquenessOracle", pool: Optional["OraclePool"] = None):
+    if pool is not None:
+        return pool.is_minimal(mask, oracle)
+
+    return all(oracle.get_number_of_solutions(mask & ~bit) != 1 for bit in mask_bits(mask))
+
+
+def reduce_to_minimal(mask: int, oracle: "UniquenessOracle") -> int:
+    # Uniqueness is monotone in the givens, so a single removal pass leaves a minimal set
+    for bit in mask_bits(mask):
+        if oracle.is_unique(mask & ~bit):
+            mask &= ~bit
+
+    return mask
+
+
+class SolverBackend(Enum):
+    # Bitmask propagation and backtracking, see `solver.KropkiSolver`
+    BITBOARD = auto()
+    # cpmpy model solved by OR-Tools
+    CPMPY = auto()
+
+
+DEFAULT_SOLVER_BACKEND = SolverBackend[os.getenv("KROPKI_SOLVER_BACKEND", "bitboard").upper()]
+
+
+class UniquenessOracle:
+    """
+    Answers uniqueness queries for subsets of the givens of a single solution.
+
+    The dot constraints of `solution` are prepared only once. With the cpmpy backend the base Sudoku
+    model is handed to OR-Tools once as well, and every given is guarded by an assumption literal,
+    so a query just re-runs the persistent solver with the literals of the selected givens.
+    Since givens are always taken from `solution`, the board has at least one solution and a query
+    only has to look for a second one, which is a single satisfiability check.
+    Results are memoized in a `UniquenessCache` of `cache_size` entries (0 disables it).
+    """
+
+    def __init__(self, solution, cache_size: int = int(os.getenv("KROPKI_ORACLE_CACHE_SIZE", 4096)),
+                 backend: SolverBackend = DEFAULT_SOLVER_BACKEND):
+        self.solution = np.asarray(solution)
+        self.backend = backend
+        self.solver_calls = 0
+        self.cache = UniquenessCache(maxsize=cache_size) if cache_size > 0 else None
+
+        # Propagation alone is cheap enough to be used for search heuristics, whatever the backend
+        self.propagator = KropkiSolver(dot_maps(self.solution))
+
+        if backend == SolverBackend.BITBOARD:
+            self.solver = self.propagator
+        elif backend == SolverBackend.CPMPY:
+            model, grid = build_kropki_base_model()
+            model += [constraint_to_model(grid, c) for c in get_dot_constraints(self.solution)]
+
+            # Any other solution must differ from the reference one in at least one cell
+            model += cp.any(grid != self.solution)
+
+            self.givens = cp.boolvar(shape=(9, 9), name="given")
+            model += [self.givens[r, c].implies(grid[r, c] == self.solution[r, c]) for r, c in grid_coords()]
+
+            self.grid = grid
+            self.solver = cp.SolverLookup.get("ortools", model)
+        else:
+            raise ValueError("Unsupported solver backend")
+
+    def get_counterexample(self, givens: int) -> Optional[np.ndarray]:
+        # Returns a solution different from the reference one agreeing with it on the `givens` mask, if any
+        if self.cache is not None and self.cache.get(givens) is True:
+            return None
+
+        return self._solve(givens)
+
+    def _solve(self, givens: int) -> Optional[np.ndarray]:
+        self.solver_calls += 1
+
+        with SOLVER_SECONDS.labels(backend=self.backend.name.lower()).time():
+            if self.backend == SolverBackend.BITBOARD:
+                solutions = self.solver.find_solutions(self.solution * mask_to_array(givens), limit=2)
+                counterexample = next((s for s in solutions if (s != self.solution).any()), None)
+            elif self.solver.solve(assumptions=[self.givens[cell] for cell in mask_cells(givens)]):
+                counterexample = self.grid.value()
+            else:
+                counterexample = None
+
+        if self.cache is not None:
+            self.cache.put(givens, counterexample is None)
+
+        return counterexample
+
+    def is_unique(self, givens: int) -> bool:
+        if self.cache is not None and (unique := self.cache.get(givens)) is not None:
+            return unique
+
+        return self._solve(givens) is None
+
+    def implied_givens(self, givens: int, candidates: int) -> int:
+        # The cells of `candidates` that propagation alone deduces from `givens`
+        fixed = self.propagator.propagate(self.solution * mask_to_array(givens))
+        if fixed is None:
+            return 0
+
+        digits = self.solution.flat
+        return sum(bit for bit in mask_bits(candidates)
+                   if fixed[bit.bit_length() - 1] == 1 << (int(digits[bit.bit_length() - 1]) - 1))
+
+    def get_number_of_solutions(self, givens: int) -> int:
+        # Number of solutions, capped at 2 like `get_number_of_solutions`
+        return 1 if self.is_unique(givens) else 2
+
+    def constraints_to_mask(self, constraints_set: Iterable[Constraint]) -> int:
+        # Dot constraints are fixed when the oracle is built, so only value constraints are considered here
+        for constraint in constraints_set:
+            if type(constraint) is CellConstraint and self.solution[constraint.cell] != constraint.value:
+                raise ValueError(f"{constraint} is not part of the oracle solution")
+
+        return constraints_to_mask(constraints_set)
+
+
+def get_number_of_solutions(constraints_set, oracle: Optional[UniquenessOracle] = None,
+                            backend: SolverBackend = DEFAULT_SOLVER_BACKEND):
+    if oracle is not None:
+        return oracle.get_number_of_solutions(oracle.constraints_to_mask(constraints_set))
+
+    if backend == SolverBackend.BITBOARD:
+        grid = np.zeros(shape=(9, 9), dtype=int)
+        for c in constraints_set:
+            if type(c) is CellConstraint:
+                grid[c.cell] = c.value
+
+        return count_solutions(grid, constraints_to_dots(constraints_set), limit=2)
+
     base_model, grid = build_kropki_base_model()
     base_model += [constraint_to_model(grid, c) for c in constraints_set]
     number_of_solutions = base_model.solveAll(solution_limit=2)
@@ -201,75 +376,218 @@ def get_number_of_solutions(constraints_set):
 
 
 def get_dot_constraints(solution):
-    grid = grid_coords()
+    return dots_to_constraints(dot_maps(solution))
 
-    dot_constraints = set()
 
-    def is_dot(cell1, cell2):
-        def is_black(cell1, cell2):
-            return solution[*cell1] == solution[*cell2] * 2 or \
-                   solution[*cell1] * 2 == solution[*cell2]
+class SeedStrategy(Enum):
+    # Add givens where the solver finds an alternative solution, at most one solver call per cell
+    GUIDED = auto()
+    # Scan every combination of `sampled_constraints` givens until a unique one is found
+    COMBINATIONS = auto()
 
-        def is_white(cell1, cell2):
-            return solution[*cell1] == solution[*cell2] + 1 or \
-                   solution[*cell1] + 1 == solution[*cell2]
 
-        if is_black(cell1, cell2):
-            return DotType.BLACK
-        elif is_white(cell, cell2):
-            return DotType.WHITE
-        else:
-            return None
+def find_seed_combinations(sampled_constraints: int, oracle: UniquenessOracle) -> int:
+    n = 0
+    for sampled_cells in combinations(sorted(grid_coords()), r=sampled_constraints):
+        n += 1
+        seed = cells_to_mask(sampled_cells)
 
-    for cell in grid:
-        r, c = cell
-        right_cell = (r, c + 1)
-        bottom_cell = (r + 1, c)
+        if oracle.get_number_of_solutions(seed) == 1:
+            return seed
 
-        if c != 8:
-            right_dot = is_dot(cell, right_cell)
+    raise RuntimeError(f"Cannot find solution with {sampled_constraints} fixed constraints! "
+                       f"Try to use a higher number instead. ({n} total combinations scanned)")
 
-            if right_dot is not None:
-                dot_constraints.add(DotConstraint({cell, right_cell}, right_dot))
 
-        if r != 8:
-            bottom_dot = is_dot(cell, bottom_cell)
+def find_seed_guided(sampled_constraints: int, oracle: UniquenessOracle,
+                     rng: Optional[random.Random] = None) -> int:
+    # Start from `sampled_constraints` random givens, then keep asking the solver for an alternative
+    # solution and fix one of the cells where it disagrees with ours. Every new given rules out at
+    # least the alternative just found, so this terminates after at most 81 solver calls.
+    rng = rng or random.Random()
+    givens = cells_to_mask(rng.sample(sorted(grid_coords()), sampled_constraints))
 
-            if bottom_dot is not None:
-                dot_constraints.add(DotConstraint({cell, bottom_cell}, bottom_dot))
+    while (counterexample := oracle.get_counterexample(givens)) is not None:
+        differing_cells = list(zip(*np.nonzero(counterexample != oracle.solution)))
+        givens |= cell_bit(rng.choice(differing_cells))
 
-    return dot_constraints
+    return givens
 
 
-def generate_kropki(solution, sampled_constraints):
-    value_constraints = {CellConstraint((r, c), solution[r, c]) for r, c in grid_coords()}
-    dot_constraints = get_dot_constraints(solution)
-    start_node = frozenset(value_constraints | dot_constraints)
+class SearchCost(Enum):
+    # Each step costs how far it moves along the cell order, so the search settles on the minimal set
+    # whose removed givens come first
+    CELL_ORDER = auto()
+    # Each removed given costs one, so the search settles on the minimal set closest to the seed
+    REMOVALS = auto()
 
-    n = 0
-    found = False
-    for sampled_value_constraints in combinations(value_constraints, r=sampled_constraints):
-        n += 1
-        start_node = frozenset(set(sampled_value_constraints) | dot_constraints)
 
-        if get_number_of_solutions(start_node) == 1:
-            found = True
-            break
+class SearchMode(Enum):
+    # Optimal for the cost model
+    A_STAR = auto()
+    # Dives towards fewer givens, backtracking only from dead ends
+    GREEDY = auto()
+    # Keeps the `beam_width` nodes with fewest givens at each depth, falling back to GREEDY if they all dead end
+    BEAM = auto()
+
+
+DEFAULT_SEARCH_COST = SearchCost[os.getenv("KROPKI_SEARCH_COST", "cell_order").upper()]
+DEFAULT_SEARCH_MODE = SearchMode[os.getenv("KROPKI_SEARCH_MODE", "a_star").upper()]
+SEARCH_BEAM_WIDTH = int(os.getenv("KROPKI_SEARCH_BEAM_WIDTH", 8))
+
+
+class CostModel:
+    """
+    Step costs and heuristic of the minimization search starting from `start_mask`.
+
+    The heuristic is an admissible lower bound on the cost left to reach a minimal given set: the cost
+    of the removals that every minimal set below the node has made (see `get_required_removals`), or
+    at least one step if the oracle cache knows a unique strict subset of the node.
+    """
+
+    def __init__(self, start_mask: int, oracle: UniquenessOracle):
+        self.start_mask = start_mask
+        self.oracle = oracle
 
-    if not found:
-        raise RuntimeError(f"Cannot find solution with {sampled_constraints} fixed constraints! "
-                           f"Try to use a higher number instead. ({n} total combinations scanned)")
+    def d(self, i: int, j: int) -> int:
+        raise NotImplementedError()
+
+    def removals_cost(self, node: int, removals: int) -> int:
+        # Least cost of removing every given of `removals` from `node`
+        raise NotImplementedError()
+
+    def h(self, node: int) -> int:
+        required = get_required_removals(node, self.start_mask, self.oracle)
+        if required:
+            return self.removals_cost(node, required)
+
+        return 1 if self.oracle.cache is not None and self.oracle.cache.has_unique_subset(node) else 0
+
+
+class CellOrderCost(CostModel):
+    def __init__(self, start_mask: int, oracle: UniquenessOracle):
+        super().__init__(start_mask, oracle)
+
+        # Position in the cell order (start holes first) of each start given, by bit length
+        self.start_holes = (FULL_MASK & ~start_mask).bit_count()
+        self.positions = {
+            bit.bit_length(): self.start_holes + rank + 1 for rank, bit in enumerate(mask_bits(start_mask))
+        }
+
+    def position(self, mask: int) -> int:
+        # Position of the last removed start given, or the number of start holes if none was removed
+        removed = self.start_mask & ~mask
+        return self.positions[removed.bit_length()] if removed else self.start_holes
+
+    def d(self, i: int, j: int) -> int:
+        return abs(self.position(i) - self.position(j))
+
+    def removals_cost(self, node: int, removals: int) -> int:
+        return self.positions[removals.bit_length()] - self.position(node)
+
+
+class RemovalsCost(CostModel):
+    def d(self, i: int, j: int) -> int:
+        return (i ^ j).bit_count()
+
+    def removals_cost(self, node: int, removals: int) -> int:
+        return removals.bit_count()
+
+
+COST_MODELS = {
+    SearchCost.CELL_ORDER: CellOrderCost,
+    SearchCost.REMOVALS: RemovalsCost,
+}
+
+
+def log_search_progress(node: int, stats: SearchStats):
+    logger.debug("Current min: {} ({})", node.bit_count(), stats)
+
+
+def minimize_mask(start_mask: int, oracle: "UniquenessOracle", stats: Optional[SearchStats] = None, on_expand=None,
+                  pool: Optional["OraclePool"] = None, cost: SearchCost = DEFAULT_SEARCH_COST,
+                  mode: SearchMode = DEFAULT_SEARCH_MODE, beam_width: int = SEARCH_BEAM_WIDTH,
+                  budget: Optional[SearchBudget] = None,
+                  on_improve: Optional[Callable[[int, SearchStats], None]] = log_search_progress) -> tuple[int, bool]:
+    """
+    Searches for a minimal unique given set inside `start_mask`, returning it and whether the search completed.
+
+    Every node of the search is a unique given set: when `budget` runs out, the search stops and the
+    node with the fewest givens seen so far is made minimal by a single removal pass, which may leave
+    more givens than the search would have. `on_improve` is called whenever a node with fewer givens
+    than any before it is generated.
+    """
+    stats = stats if stats is not None else SearchStats()
+    best_mask = start_mask
+
+    def neighbors(n: int) -> list[int]:
+        nonlocal best_mask
+
+        masks = get_neighbor_masks(n, start_mask, oracle, pool)
+        for mask in masks:
+            if mask.bit_count() < best_mask.bit_count():
+                best_mask = mask
+                if on_improve is not None:
+                    on_improve(mask, stats)
+
+        return masks
+
+    cost_model = COST_MODELS[cost](start_mask, oracle)
+    search = {
+        "start_node": start_mask,
+        "is_goal": lambda n: is_minimal_mask(n, oracle, pool),
+        "neighbors": neighbors,
+        "stats": stats,
+        "on_expand": on_expand,
+        "budget": budget,
+    }
+    # Fewest givens first, then the cost model decides
+    greedy_key = lambda n: (n.bit_count(), cost_model.d(start_mask, n) + cost_model.h(n))
+
+    try:
+        if mode == SearchMode.A_STAR:
+            return a_star(h=cost_model.h, d=cost_model.d, **search), True
+        elif mode == SearchMode.GREEDY:
+            return best_first(key=greedy_key, **search), True
+        elif mode == SearchMode.BEAM:
+            mask = beam_search(key=greedy_key, width=beam_width, **search)
+            if mask is None:
+                logger.debug("Beam search dead ended, falling back to greedy search")
+                mask = best_first(key=greedy_key, **search)
+
+            return mask, True
+        else:
+            raise ValueError("Unsupported search mode")
+    except BudgetExhausted as e:
+        logger.info("Search budget exhausted, keeping the best puzzle found: {} givens ({})",
+                    best_mask.bit_count(), e.stats)
+        SEARCH_BUDGET_EXHAUSTED.labels(mode=mode.name.lower()).inc()
+        return reduce_to_minimal(best_mask, oracle), False
+    finally:
+        SEARCH_EXPANDED_NODES.labels(mode=mode.name.lower()).observe(stats.expanded_nodes)
+
+
+def generate_kropki(solution, sampled_constraints, seed_strategy: SeedStrategy = SeedStrategy.GUIDED,
+                    stats: Optional[SearchStats] = None, on_expand=None, pool: Optional["OraclePool"] = None,
+                    cost: SearchCost = DEFAULT_SEARCH_COST, mode: SearchMode = DEFAULT_SEARCH_MODE,
+                    beam_width: int = SEARCH_BEAM_WIDTH, rng: Optional[random.Random] = None,
+                    budget: Optional[SearchBudget] = None,
+                    on_improve: Optional[Callable[[int, SearchStats], None]] = log_search_progress):
+    # Returns the kropki constraints, the full solution constraints and whether the search completed
+    value_constraints = {CellConstraint((r, c), solution[r, c]) for r, c in grid_coords()}
+    dot_constraints = get_dot_constraints(solution)
+    oracle = UniquenessOracle(solution)
+
+    if seed_strategy == SeedStrategy.GUIDED:
+        start_mask = find_seed_guided(sampled_constraints, oracle, rng)
+    elif seed_strategy == SeedStrategy.COMBINATIONS:
+        start_mask = find_seed_combinations(sampled_constraints, oracle)
+    else:
+        raise ValueError("Unsupported seed strategy")
 
-    def distance(i: frozenset[Constraint], j: frozenset[Constraint], start_node: frozenset[Constraint]):
-        i_index = get_last_chosen_cell_index(i, start_node)
-        j_index = get_last_chosen_cell_index(j, start_node)
+    kropki_mask, complete = minimize_mask(start_mask, oracle, stats=stats, on_expand=on_expand, pool=pool, cost=cost,
+                                          mode=mode, beam_width=beam_width, budget=budget, on_improve=on_improve)
 
-        return abs(i_index - j_index)
+    logger.debug("Minimization done: {} solver calls, {}", oracle.solver_calls, oracle.cache)
 
-    return a_star(
-        start_node=start_node,
-        is_goal=is_minimal_constraint_set,
-        neighbors=lambda n: get_neighbor_constraints_set(n, start_node),
-        h=lambda n: 0,
-        d=lambda i, j: distance(i, j, start_node)
-    ), value_constraints
+    return frozenset(mask_to_constraints(kropki_mask, solution) | dot_constraints), value_constraints, complete
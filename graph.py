@@ -1,21 +1,48 @@
-from collections import defaultdict
-from functools import total_ordering
+import heapq
+import math
+import time
+from itertools import count
+from typing import Callable, Optional
 
 
-@total_ordering
-class Infinity:
-    def __lt__(self, other):
-        if type(other) in {int, Infinity}:
-            return False
-        else:
-            raise TypeError("Only integers can be compared against `Infinity`")
+class SearchStats:
+    def __init__(self):
+        self.expanded_nodes = 0
+        self.duplicates_skipped = 0
+        self.open_set_size = 0
+        self.max_open_set_size = 0
 
-    def __eq__(self, other):
-        return type(other) is Infinity
+    def __repr__(self):
+        return f"SearchStats(expanded_nodes={self.expanded_nodes}, duplicates_skipped={self.duplicates_skipped}, " \
+               f"open_set_size={self.open_set_size}, max_open_set_size={self.max_open_set_size})"
 
-    def __add__(self, other):
-        if type(other) in {int, Infinity}:
-            return self
+
+class SearchBudget:
+    """
+    Bounds a search by expanded nodes and/or wall-clock seconds, counted from the budget creation.
+    A search that runs out of budget raises BudgetExhausted before expanding the next node.
+    """
+
+    def __init__(self, seconds: Optional[float] = None, expansions: Optional[int] = None):
+        self.expansions = expansions
+        self.deadline = time.monotonic() + seconds if seconds is not None else None
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def check(self, stats: SearchStats):
+        if self.expired or (self.expansions is not None and stats.expanded_nodes >= self.expansions):
+            raise BudgetExhausted(stats)
+
+    def __repr__(self):
+        return f"SearchBudget(deadline={self.deadline}, expansions={self.expansions})"
+
+
+class BudgetExhausted(Exception):
+    def __init__(self, stats: SearchStats):
+        super().__init__(f"Search budget exhausted ({stats})")
+        self.stats = stats
 
 
 def reconstruct_path(came_from, current):
@@ -27,38 +54,125 @@ def reconstruct_path(came_from, current):
     return list(reversed(total_path))
 
 
-def a_star(start_node, is_goal, neighbors, h, d):
-    openset = {start_node}
+def a_star(start_node, is_goal, neighbors, h, d, stats: Optional[SearchStats] = None,
+           on_expand: Optional[Callable[[object, SearchStats], None]] = None, budget: Optional[SearchBudget] = None):
+    if stats is None:
+        stats = SearchStats()
+
+    # Entries are never removed from the heap: when a node gets a better score it is pushed again and
+    # the stale entry is skipped once popped. The counter breaks ties without comparing nodes.
+    tie_breaker = count()
+    openset = [(h(start_node), next(tie_breaker), start_node)]
     came_from = {}
 
-    best_costs = defaultdict(Infinity)
-    best_costs[start_node] = 0
+    best_costs = {start_node: 0}
+    best_scores = {start_node: h(start_node)}
 
-    best_scores = defaultdict(Infinity)
-    best_scores[start_node] = h(start_node)
+    while openset:
+        score, _, current = heapq.heappop(openset)
 
-    min_c = Infinity()
+        if score > best_scores[current]:
+            stats.duplicates_skipped += 1
+            continue
 
-    while openset:
-        current = min(openset, key=lambda n: best_scores[n])
+        if budget is not None:
+            budget.check(stats)
 
-        if len(current) < min_c:
-            min_c = len(current)
-            print(f"Current min: {min_c}")
+        # Mark the node as expanded, so that other entries for it are skipped too
+        best_scores[current] = -math.inf
+
+        stats.expanded_nodes += 1
+        stats.open_set_size = len(openset)
+        if on_expand is not None:
+            on_expand(current, stats)
 
         if is_goal(current):
             return current
 
-        openset.remove(current)
         for neighbor in neighbors(current):
             tentative_cost = best_costs[current] + d(current, neighbor)
 
-            if tentative_cost < best_costs[neighbor]:
+            if tentative_cost < best_costs.get(neighbor, math.inf):
                 came_from[neighbor] = current
                 best_costs[neighbor] = tentative_cost
                 best_scores[neighbor] = tentative_cost + h(neighbor)
 
-                if neighbor not in openset:
-                    openset.add(neighbor)
+                heapq.heappush(openset, (best_scores[neighbor], next(tie_breaker), neighbor))
+
+        stats.open_set_size = len(openset)
+        stats.max_open_set_size = max(stats.max_open_set_size, stats.open_set_size)
+
+    return None
+
+
+def best_first(start_node, is_goal, neighbors, key, stats: Optional[SearchStats] = None,
+               on_expand: Optional[Callable[[object, SearchStats], None]] = None, budget: Optional[SearchBudget] = None):
+    # Greedy best-first search: always expands the open node with the lowest key, regardless of path costs
+    if stats is None:
+        stats = SearchStats()
+
+    tie_breaker = count()
+    openset = [(key(start_node), next(tie_breaker), start_node)]
+    seen = {start_node}
+
+    while openset:
+        _, _, current = heapq.heappop(openset)
+
+        if budget is not None:
+            budget.check(stats)
+
+        stats.expanded_nodes += 1
+        stats.open_set_size = len(openset)
+        if on_expand is not None:
+            on_expand(current, stats)
+
+        if is_goal(current):
+            return current
+
+        for neighbor in neighbors(current):
+            if neighbor in seen:
+                stats.duplicates_skipped += 1
+                continue
+
+            seen.add(neighbor)
+            heapq.heappush(openset, (key(neighbor), next(tie_breaker), neighbor))
+
+        stats.open_set_size = len(openset)
+        stats.max_open_set_size = max(stats.max_open_set_size, stats.open_set_size)
+
+    return None
+
+
+def beam_search(start_node, is_goal, neighbors, key, width: int, stats: Optional[SearchStats] = None,
+                on_expand: Optional[Callable[[object, SearchStats], None]] = None, budget: Optional[SearchBudget] = None):
+    # Breadth-first search keeping only the `width` nodes with the lowest key at each depth.
+    # Incomplete: returns None if every kept node is a dead end
+    if stats is None:
+        stats = SearchStats()
+
+    level = [start_node]
+    while level:
+        next_level = {}
+
+        for current in level:
+            if budget is not None:
+                budget.check(stats)
+
+            stats.expanded_nodes += 1
+            if on_expand is not None:
+                on_expand(current, stats)
+
+            if is_goal(current):
+                return current
+
+            for neighbor in neighbors(current):
+                if neighbor in next_level:
+                    stats.duplicates_skipped += 1
+                next_level[neighbor] = None
+
+        level = heapq.nsmallest(width, next_level, key=key)
+
+        stats.open_set_size = len(level)
+        stats.max_open_set_size = max(stats.max_open_set_size, len(next_level))
 
     return None
@@ -0,0 +1,106 @@
+import random
+from typing import Optional
+
+import numpy as np
+
+from solver import ALL_DIGITS
+
+
+def random_grid(rng: Optional[random.Random] = None) -> np.ndarray:
+    """Builds a full, valid Sudoku grid by randomized backtracking over candidate bitmasks."""
+    rng = rng or random.Random()
+
+    # Free digits of each row/column/box, bit `v - 1` standing for digit `v`
+    rows = [ALL_DIGITS] * 9
+    cols = [ALL_DIGITS] * 9
+    boxes = [ALL_DIGITS] * 9
+    cells = [0] * 81
+
+    def fill(i: int) -> bool:
+        if i == 81:
+            return True
+
+        r, c = divmod(i, 9)
+        b = (r // 3) * 3 + c // 3
+        free = rows[r] & cols[c] & boxes[b]
+
+        digits = [v for v in range(1, 10) if free & (1 << (v - 1))]
+        rng.shuffle(digits)
+
+        for v in digits:
+            bit = 1 << (v - 1)
+            rows[r] ^= bit
+            cols[c] ^= bit
+            boxes[b] ^= bit
+            cells[i] = v
+
+            if fill(i + 1):
+                return True
+
+            rows[r] ^= bit
+            cols[c] ^= bit
+            boxes[b] ^= bit
+
+        return False
+
+    fill(0)
+
+    return np.array(cells, dtype=np.uint8).reshape(9, 9)
+
+
+def random_line_permutations(n: int, rng: np.random.Generator) -> np.ndarray:
+    # (n, 9) permutations of rows (or columns) that keep a grid valid: bands are shuffled,
+    # and so are the rows inside each band
+    bands = np.argsort(rng.random((n, 3)), axis=1)
+    inner = np.argsort(rng.random((n, 3, 3)), axis=2)
+
+    return (3 * bands[:, :, None] + np.take_along_axis(inner, bands[:, :, None], axis=1)).reshape(n, 9)
+
+
+def transform_grids(grids: np.ndarray, row_perms: np.ndarray, col_perms: np.ndarray,
+                    digit_perms: np.ndarray, transpose: np.ndarray) -> np.ndarray:
+    """
+    Applies validity-preserving transformations to a (n, 9, 9) batch of grids: rows and columns
+    are reordered by the (n, 9) permutations, digits are relabeled through the (n, 10) lookup
+    tables (entry 0 mapping to 0), and the grids flagged in `transpose` are transposed.
+    """
+    grids = np.where(transpose[:, None, None], grids.transpose(0, 2, 1), grids)
+    grids = np.take_along_axis(grids, row_perms[:, :, None], axis=1)
+    grids = np.take_along_axis(grids, col_perms[:, None, :], axis=2)
+
+    return np.take_along_axis(digit_perms, grids.reshape(len(grids), 81).astype(np.intp), axis=1) \
+        .reshape(grids.shape).astype(np.uint8)
+
+
+def random_grids(n: int, seed: Optional[int] = None, base_grids: Optional[int] = None) -> np.ndarray:
+    """
+    (n, 9, 9) random grids, each built by backtracking. With `base_grids`, only that many are built
+    and spread over the `n` outputs by random symmetries: faster for large batches, but the outputs
+    are then copies of at most `base_grids` essentially different grids.
+    """
+    py_rng = random.Random(seed)
+
+    if base_grids is None or base_grids >= n:
+        return np.array([random_grid(py_rng) for _ in range(n)], dtype=np.uint8).reshape(n, 9, 9)
+
+    rng = np.random.default_rng(seed)
+    bases = np.stack([random_grid(py_rng) for _ in range(base_grids)])
+    grids = bases[rng.integers(len(bases), size=n)]
+
+    digit_perms = np.zeros(shape=(n, 10), dtype=np.uint8)
+    digit_perms[:, 1:] = np.argsort(rng.random((n, 9)), axis=1) + 1
+
+    return transform_grids(
+        grids,
+        row_perms=random_line_permutations(n, rng),
+        col_perms=random_line_permutations(n, rng),
+        digit_perms=digit_perms,
+        transpose=rng.random(n) < 0.5
+    )
+
+
+def is_valid_grid(grid: np.ndarray) -> bool:
+    boxes = grid.reshape(3, 3, 3, 3).transpose(0, 2, 1, 3).reshape(9, 9)
+    expected = np.arange(1, 10)
+
+    return all((np.sort(lines, axis=1) == expected).all() for lines in (grid, grid.T, boxes))
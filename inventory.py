@@ -0,0 +1,216 @@
+import json
+import os
+from typing import Optional
+
+import redis
+import redis.asyncio
+from loguru import logger
+
+import numpy as np
+
+from generator import generate_kropki, CellConstraint, constraints_to_dots, SearchMode, DEFAULT_SEARCH_MODE
+from graph import SearchBudget
+from metrics import GENERATION_SECONDS, REDIS_SECONDS, STOCK_PUZZLES
+from ken import encode_ken
+from packed import pack_board, unpack_board, is_packed_board
+from rating import Difficulty, rate_board
+
+# Samplings kept in stock, e.g. "5,10"
+STOCK_SAMPLINGS = [int(s) for s in os.getenv("KROPKI_STOCK_SAMPLINGS", "5").split(",")]
+
+# A bucket is refilled once it drops below the low watermark, and then until it reaches the high one
+STOCK_LOW_WATERMARK = int(os.getenv("KROPKI_STOCK_LOW_WATERMARK", 20))
+STOCK_HIGH_WATERMARK = int(os.getenv("KROPKI_STOCK_HIGH_WATERMARK", 100))
+# Puzzles of a difficulty are generated for its bucket while it is below its own low watermark, unless the
+# sampling already holds STOCK_MAX_SIZE puzzles: some difficulties may be rare for a given sampling
+STOCK_DIFFICULTY_LOW_WATERMARK = int(os.getenv("KROPKI_STOCK_DIFFICULTY_LOW_WATERMARK", 5))
+STOCK_MAX_SIZE = int(os.getenv("KROPKI_STOCK_MAX_SIZE", 2 * STOCK_HIGH_WATERMARK))
+
+# Puzzles made while looking for one of a given difficulty
+DIFFICULTY_ATTEMPTS = int(os.getenv("KROPKI_DIFFICULTY_ATTEMPTS", 8))
+
+REFILLING_KEY = "kropki:stock:refilling"
+
+# Stock puzzles are bucketed by sampling and difficulty; the unrated bucket only holds puzzles
+# stocked before ratings
+STOCK_DIFFICULTIES = [d for d in Difficulty]
+RATED_DIFFICULTIES = [d for d in Difficulty if d != Difficulty.UNRATED]
+
+# A stock puzzle along with its difficulty
+RatedPuzzle = tuple[bytes, Difficulty]
+
+
+def stock_key(sampling: int, difficulty: Difficulty = Difficulty.UNRATED) -> str:
+    if difficulty == Difficulty.UNRATED:
+        return f"kropki:stock:{sampling}"
+
+    return f"kropki:stock:{sampling}:{difficulty.name.lower()}"
+
+
+def stock_difficulty(key: bytes) -> Difficulty:
+    parts = str(key, 'utf8').split(":")
+    return Difficulty[parts[3].upper()] if len(parts) > 3 else Difficulty.UNRATED
+
+
+def make_puzzle(solution, sampling: int, mode: SearchMode = DEFAULT_SEARCH_MODE,
+                budget: Optional[SearchBudget] = None) -> bytes:
+    # Puzzles are packed records: the full solution, the given cells and the dots.
+    # Past the budget, the givens are minimal but may be more than the full search would have left
+    with GENERATION_SECONDS.labels(sampling=str(sampling)).time():
+        kropki, _, _ = generate_kropki(solution, sampling, mode=mode, budget=budget)
+
+    givens = np.zeros(shape=(9, 9), dtype=bool)
+    for constraint in kropki:
+        if type(constraint) is CellConstraint:
+            givens[constraint.cell] = True
+
+    return pack_board(solution, givens, constraints_to_dots(kropki))
+
+
+def make_rated_puzzles(solution, sampling: int, difficulty: Optional[Difficulty] = None,
+                       mode: SearchMode = DEFAULT_SEARCH_MODE, budget: Optional[SearchBudget] = None) -> list[RatedPuzzle]:
+    # With a target difficulty, puzzles are made from the same solution until one matches; the
+    # closest one comes last
+    puzzles = []
+    for _ in range(1 if difficulty is None else DIFFICULTY_ATTEMPTS):
+        puzzle = make_puzzle(solution, sampling, mode, budget)
+        puzzles.append((puzzle, rate_board(puzzle)))
+
+        if difficulty is None or puzzles[-1][1] == difficulty or (budget is not None and budget.expired):
+            break
+
+    if difficulty is not None:
+        puzzles.sort(key=lambda p: abs(p[1] - difficulty), reverse=True)
+
+    return puzzles
+
+
+def puzzle_to_ken(puzzle: bytes, difficulty: Difficulty = Difficulty.UNRATED) -> dict:
+    # Stock entries pushed before the packed format are already JSON encoded
+    if not is_packed_board(puzzle):
+        return json.loads(puzzle)
+
+    digits, givens, dots = unpack_board(puzzle)
+
+    result = {
+        "ken": encode_ken(np.where(givens, digits, 0), dots),
+        "solution": encode_ken(digits)
+    }
+    if difficulty != Difficulty.UNRATED:
+        result["difficulty"] = difficulty.name.lower()
+
+    return result
+
+
+async def pop_puzzles_async(r: redis.asyncio.Redis, sampling: int, count: int,
+                            difficulty: Optional[Difficulty] = None) -> list[RatedPuzzle]:
+    """
+    Pops up to `count` puzzles of the given difficulty, or of any difficulty if None. In the latter
+    case, the puzzles are drawn at random across the buckets, in proportion to their sizes, so that
+    no difficulty is drained before the others.
+    """
+    if count <= 0:
+        return []
+
+    with REDIS_SECONDS.labels(operation="pop_puzzles").time():
+        if difficulty is not None:
+            return [(puzzle, difficulty) for puzzle in await r.lpop(stock_key(sampling, difficulty), count) or []]
+
+        puzzles = []
+        keys = [stock_key(sampling, d) for d in STOCK_DIFFICULTIES]
+        rng = np.random.default_rng()
+        while len(puzzles) < count:
+            pipeline = r.pipeline(transaction=False)
+            for key in keys:
+                pipeline.llen(key)
+            sizes = await pipeline.execute()
+            if not any(sizes):
+                break
+
+            # Other requests may pop the same buckets in the meantime, which takes another round
+            taken = rng.multivariate_hypergeometric(sizes, min(count - len(puzzles), sum(sizes)))
+            pipeline = r.pipeline(transaction=False)
+            for key, n in zip(keys, taken):
+                if n:
+                    pipeline.lpop(key, int(n))
+
+            popped = [
+                (puzzle, d)
+                for d, entries in zip([d for d, n in zip(STOCK_DIFFICULTIES, taken) if n], await pipeline.execute())
+                for puzzle in entries or []
+            ]
+            if not popped:
+                break
+
+            puzzles.extend(popped)
+
+        return puzzles
+
+
+@REDIS_SECONDS.labels(operation="push_puzzle").time()
+def push_puzzle(r: redis.Redis, sampling: int, puzzle: bytes, difficulty: Difficulty = Difficulty.UNRATED):
+    r.rpush(stock_key(sampling, difficulty), puzzle)
+
+
+async def push_puzzles_async(r: redis.asyncio.Redis, sampling: int, puzzles: list[RatedPuzzle]):
+    # Pushes every puzzle in a single round-trip
+    if not puzzles:
+        return
+
+    with REDIS_SECONDS.labels(operation="push_puzzle").time():
+        pipeline = r.pipeline(transaction=False)
+        for puzzle, difficulty in puzzles:
+            pipeline.rpush(stock_key(sampling, difficulty), puzzle)
+
+        await pipeline.execute()
+
+
+@REDIS_SECONDS.labels(operation="next_bucket_to_refill").time()
+def next_bucket_to_refill(r: redis.Redis) -> Optional[tuple[int, Optional[Difficulty]]]:
+    """
+    Returns the sampling of the emptiest bucket that needs puzzles, if any, along with the difficulty
+    to aim for: the emptiest rated bucket of that sampling below its own low watermark, or None
+    for puzzles of any difficulty.
+    """
+    pipeline = r.pipeline()
+    for sampling in STOCK_SAMPLINGS:
+        for difficulty in STOCK_DIFFICULTIES:
+            pipeline.llen(stock_key(sampling, difficulty))
+        pipeline.sismember(REFILLING_KEY, sampling)
+
+    results = pipeline.execute()
+    step = len(STOCK_DIFFICULTIES) + 1
+
+    candidates = []
+    for i, sampling in enumerate(STOCK_SAMPLINGS):
+        sizes = dict(zip(STOCK_DIFFICULTIES, results[i * step:(i + 1) * step - 1]))
+        for difficulty, size in sizes.items():
+            STOCK_PUZZLES.labels(sampling=str(sampling), difficulty=difficulty.name.lower()).set(size)
+
+        # Watermarks apply to a sampling as a whole: the difficulty of a new puzzle is only known once generated
+        size = sum(sizes.values())
+        refilling = results[(i + 1) * step - 1]
+
+        emptiest = min(RATED_DIFFICULTIES, key=lambda d: sizes[d])
+        target = emptiest if sizes[emptiest] < STOCK_DIFFICULTY_LOW_WATERMARK else None
+
+        if size >= STOCK_HIGH_WATERMARK:
+            if refilling:
+                r.srem(REFILLING_KEY, sampling)
+            if target is not None and size < STOCK_MAX_SIZE:
+                candidates.append((sizes[target], sampling, target))
+        elif size < STOCK_LOW_WATERMARK or refilling:
+            if not refilling:
+                logger.info("Stock for sampling {} is low ({} puzzles), refilling", sampling, size)
+                r.sadd(REFILLING_KEY, sampling)
+
+            candidates.append((size, sampling, target))
+        elif target is not None:
+            candidates.append((sizes[target], sampling, target))
+
+    if not candidates:
+        return None
+
+    _, sampling, difficulty = min(candidates, key=lambda c: c[0])
+
+    return sampling, difficulty
@@ -1,190 +1,218 @@
-from collections import defaultdict
-from typing import Optional
+from typing import Optional, Iterable, Iterator
 
-from generator import Constraint, grid_coords, CellConstraint, DotConstraint, DotType
+from bitboard import BOTTOM, RIGHT, DOT_NONE, DOT_WHITE, DOT_BLACK
+from generator import Constraint, CellConstraint, constraints_to_dots, dots_to_constraints
+from metrics import REDIS_SECONDS
+from packed import is_packed_board, unpack_board, unpack_boards, frombuffer
 
 import redis
+import redis.asyncio
 import os
 import re
 import numpy as np
 
-def encode_dot_type(dot_type: Optional[DotType]):
-    if dot_type == DotType.WHITE:
-        return "w"
-    elif dot_type == DotType.BLACK:
-        return "k"
-    else:
-        return None
+# A KEN token is a digit, a parenthesized cell with dots, a run of 1-9 empty cells or a row separator
+KEN_TOKEN = re.compile(r"[1-9]|\([1-9]?[wxk][wxk]\)|[A-I]|/")
 
+# Runs of empty cells are written as a single letter, A for one cell up to H for eight.
+# A full empty row is written as HA, which decoders that only know A-H still understand
+EMPTY_RUN = re.compile("A+")
+EMPTY_RUN_LETTERS = {n: "ABCDEFGH"[n - 1] for n in range(1, 9)} | {9: "HA"}
 
-def encode_constraints_for_cell(constraints: set[Constraint]) -> str:
-    value = None
-    bottom = None
-    right = None
+DOT_LETTERS = {DOT_NONE: "x", DOT_WHITE: "w", DOT_BLACK: "k"}
+LETTER_DOTS = {letter: dot for dot, letter in DOT_LETTERS.items()}
 
-    for constraint in constraints:
-        if type(constraint) == CellConstraint:
-            value = constraint.value
-        elif type(constraint) == DotConstraint:
-            reference_cell = constraint.reference_cell()
-            other_cell = set(constraint.cells() - {constraint.reference_cell()}).pop()
-
-            if reference_cell[0] == other_cell[0] and reference_cell[1] == other_cell[1] - 1:
-                right = constraint.dot_type
-            elif reference_cell[0] == other_cell[0] - 1 and reference_cell[1] == other_cell[1]:
-                bottom = constraint.dot_type
-            else:
-                raise RuntimeError(f"Invalid cell combination for dot constraint! {constraint.cells()}")
-
-            1 + 1
-
-    if value is not None and bottom is None and right is None:
-        return f"{value}"
-    else:
-        value = value or ""
-        bottom = encode_dot_type(bottom) or "x"
-        right = encode_dot_type(right) or "x"
 
-        return f"({value}{bottom}{right})"
+def encode_cell(value: int, bottom: int, right: int) -> str:
+    if bottom == DOT_NONE and right == DOT_NONE:
+        return str(value) if value else "A"
+    else:
+        return f"({value or ''}{DOT_LETTERS[bottom]}{DOT_LETTERS[right]})"
 
 
 def rle_ken(ken: str) -> str:
-    compact_ken = ""
-
-    empty_cell_substitutions = {
-        1: "A",
-        2: "B",
-        3: "C",
-        4: "D",
-        5: "E",
-        6: "F",
-        7: "G",
-        8: "H"
-    }
-
-    a_count = 0
-    for char in ken:
-        if char == "A":
-            a_count += 1
+    return EMPTY_RUN.sub(lambda m: EMPTY_RUN_LETTERS[len(m.group())], ken)
+
+
+def encode_ken(values: np.ndarray, dots: Optional[np.ndarray] = None) -> str:
+    """Encodes a (9, 9) array of digits (0 for empty cells) and a (2, 9, 9) dot map into KEN."""
+    values = np.asarray(values).tolist()
+    bottoms = dots[BOTTOM].tolist() if dots is not None else [[DOT_NONE] * 9] * 9
+    rights = dots[RIGHT].tolist() if dots is not None else [[DOT_NONE] * 9] * 9
+
+    rows = ("".join(map(encode_cell, *row)) for row in zip(values, bottoms, rights))
+
+    return rle_ken("/".join(rows))
+
+
+def decode_ken_arrays(ken: str) -> tuple[np.ndarray, np.ndarray]:
+    """Decodes KEN into a (9, 9) uint8 array of digits (0 for empty cells) and a (2, 9, 9) dot map."""
+    tokens = KEN_TOKEN.findall(ken)
+    if "".join(tokens) != ken:
+        raise ValueError(f"Invalid KEN: {ken}")
+
+    values = np.zeros(shape=81, dtype=np.uint8)
+    dots = np.zeros(shape=(2, 81), dtype=np.uint8)
+
+    row = 0
+    i = 0
+    for token in tokens:
+        if token == "/":
+            if i != 9 * (row + 1):
+                raise ValueError(f"Invalid number of cells in row {row}! ({i - 9 * row} != 9)")
+            if row == 8:
+                raise RuntimeError(f"Invalid number of rows! ({ken.count('/') + 1} != 9)")
+            row += 1
+            continue
+
+        if i >= 9 * (row + 1):
+            raise ValueError(f"Too many cells in row {row}!")
+
+        if token.isdigit():
+            values[i] = int(token)
+            i += 1
+        elif token[0] == "(":
+            if len(token) == 5:
+                values[i] = int(token[1])
+
+            dots[BOTTOM, i] = LETTER_DOTS[token[-3]]
+            dots[RIGHT, i] = LETTER_DOTS[token[-2]]
+            i += 1
         else:
-            if a_count > 0:
-                compact_ken += empty_cell_substitutions[a_count]
-                a_count = 0
+            i += ord(token) - ord("A") + 1
 
-            compact_ken += char
+            if i > 9 * (row + 1):
+                raise ValueError(f"Too many cells in row {row}!")
 
-    return compact_ken
+    # Older encoders dropped the empty cells at the very end of the board, so a short last row is fine
+    if row != 8:
+        raise RuntimeError(f"Invalid number of rows! ({row + 1} != 9)")
 
+    return values.reshape(9, 9), dots.reshape(2, 9, 9)
 
-def encode_constraints(constraints_set: set[Constraint]) -> str:
-    constraints_by_cell = defaultdict(set)
 
+def encode_constraints(constraints_set: set[Constraint]) -> str:
+    values = np.zeros(shape=(9, 9), dtype=np.uint8)
     for constraint in constraints_set:
-        constraints_by_cell[constraint.reference_cell()].add(constraint)
+        if type(constraint) is CellConstraint:
+            values[constraint.cell] = constraint.value
 
-    grid = list(sorted(grid_coords()))
+    return encode_ken(values, constraints_to_dots(constraints_set))
 
-    ken = ""
-    for cell in grid:
-        if cell in constraints_by_cell.keys():
-            encoded = encode_constraints_for_cell(constraints_by_cell[cell])
 
-            ken += encoded
-        else:
-            ken += "A"
+def decode_ken(ken):
+    values, dots = decode_ken_arrays(ken)
 
-        if cell[1] == 8 and cell[0] != 8:
-            ken += "/"
+    constraints = {CellConstraint((r, c), int(values[r, c])) for r, c in zip(*np.nonzero(values))}
 
-    assert len(ken.split("/")) == 9, f"splits: {len(ken.split('/'))}"
-    return rle_ken(ken)
+    return constraints | dots_to_constraints(dots)
 
 
-def next_cell(cell):
-    if cell[1] == 8 and cell[0] != 8:
-        return cell[0] + 1, 0
-    elif cell[1] == 8 and cell[0] == 8:
-        return None
-    else:
-        return cell[0], cell[1] + 1
+def ken_to_grid(ken: str) -> np.ndarray:
+    values, _ = decode_ken_arrays(ken)
+    return values
 
-def letter_to_dot(letter):
-    if letter == "w":
-        return DotType.WHITE
-    elif letter == "k":
-        return DotType.BLACK
-    else:
-        return None
 
-def decode_dot_constraints(constraint, cell):
-    if len(constraint) == 4:
-        par1, bottom, right, par2 = constraint.split("")
-        value = None
+def entry_to_grid(entry: bytes) -> np.ndarray:
+    # Stored boards are either packed records or KEN strings
+    if is_packed_board(entry):
+        digits, _, _ = unpack_board(entry)
+        return digits
+
+    return ken_to_grid(str(entry, 'utf8'))
+
+
+def entries_to_grids(entries: list[bytes]) -> np.ndarray:
+    # Packed records are decoded all at once, KEN strings one by one
+    grids = np.zeros(shape=(len(entries), 9, 9), dtype=np.uint8)
+
+    packed = [i for i, entry in enumerate(entries) if is_packed_board(entry)]
+    if packed:
+        grids[packed], _, _ = unpack_boards(frombuffer(b"".join(entries[i] for i in packed)))
+
+    packed = set(packed)
+    for i, entry in enumerate(entries):
+        if i not in packed:
+            grids[i] = ken_to_grid(str(entry, 'utf8'))
+
+    return grids
+
+
+def decode_kens(kens: Iterable[str | bytes]) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    for ken in kens:
+        yield decode_ken_arrays(ken if isinstance(ken, str) else str(ken, 'utf8'))
+
+
+def encode_kens(values: Iterable[np.ndarray], dots: Optional[Iterable[np.ndarray]] = None) -> Iterator[str]:
+    if dots is None:
+        yield from map(encode_ken, values)
     else:
-        par1, value, bottom, right, par2 = constraint.split("")
+        yield from map(encode_ken, values, dots)
 
-    bottom = letter_to_dot(bottom)
-    right = letter_to_dot(right)
 
-    result = {}
+def decode_ken_batch(kens: Iterable[str | bytes]) -> tuple[np.ndarray, np.ndarray]:
+    # Stacks decoded boards into (n, 9, 9) digits and (n, 2, 9, 9) dot maps
+    decoded = list(decode_kens(kens))
+    if not decoded:
+        return np.empty(shape=(0, 9, 9), dtype=np.uint8), np.empty(shape=(0, 2, 9, 9), dtype=np.uint8)
 
-    if bottom:
-        result.add(DotConstraint({cell, (cell[0] + 1, cell[1])}))
-    
-    if right:
-        result.add(DotConstraint({cell, (cell[0], cell[1] + 1)}))
-    
-    if value:
-        result.add(CellConstraint(cell, int(value)))
+    values, dots = zip(*decoded)
 
-    return result
+    return np.stack(values), np.stack(dots)
 
-def decode_value_constraint(constraint, cell):
-    return CellConstraint(cell, int(constraint))
 
-def decode_ken(ken):
-    rows = ken.split("/")
-
-    if len(rows) != 9:
-        raise RuntimeError(f"Invalid number of rows! ({len(rows)} != 9)")
-    
-    constraints = set()
-    cell = (0, 0)
-    for r in rows:
-        row = r
-        while row:
-            value_constraint = re.compile("[1-9]")
-            dot_constraint = re.compile("\(([1-9])?(w|x|k)(w|x|k)\)")
-
-            if value_constraint.match(row):
-                constraint = row[0]
-                row = row[1:]
-                constraints.add(decode_value_constraint(constraint, cell))
-                cell = next_cell(cell)
-            elif dot_constraint.match(row):
-                groups = dot_constraint.match(row).groups()
-                if len(groups) == 2:
-                    constraint = row[0:4]
-                    row = row[5:]
-                else:
-                    constraint = row[0:5]
-                    row = row[6:]
-
-                constraints += decode_dot_constraints(constraint, cell)
-                cell = next_cell(cell)
-
-    return constraints
+def scan_kens(r: redis.Redis, key: str, count: int = 1000) -> Iterator[str]:
+    # Streams the boards of a Redis set as KEN strings without loading it in memory at once; packed
+    # records are re-encoded from their givens and dots
+    for entry in r.sscan_iter(key, count=count):
+        if is_packed_board(entry):
+            digits, givens, dots = unpack_board(entry)
+            yield encode_ken(digits * givens, dots)
+        else:
+            yield str(entry, 'utf8')
+
+
+def read_kens(path: str) -> Iterator[str]:
+    # Streams the KEN strings of a file, one per line
+    with open(path) as f:
+        for line in f:
+            if line := line.strip():
+                yield line
+
 
 def constraints_to_grid(constraints):
     result = np.zeros(shape=(9, 9))
 
     for constraint in constraints:
-        result[*constraint.reference_cell()] = constraint.value
+        if type(constraint) is CellConstraint:
+            result[*constraint.reference_cell()] = constraint.value
 
     return result.astype(int)
 
 
-def retrieve_kropki_solution():
-    r = redis.from_url(os.getenv("REDIS_KEYS_URL"))
+_redis_client: Optional[redis.Redis] = None
+
+
+def redis_client() -> redis.Redis:
+    # One client, and so one connection pool, per process; redis-py pools reset themselves after a fork
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.from_url(os.getenv("REDIS_KEYS_URL"))
+
+    return _redis_client
+
+
+@REDIS_SECONDS.labels(operation="retrieve_solution").time()
+def retrieve_kropki_solution(r: Optional[redis.Redis] = None):
+    if r is None:
+        r = redis_client()
+
+    return entry_to_grid(r.srandmember("sudokus")).astype(int)
+
+
+async def retrieve_kropki_solutions_async(r: redis.asyncio.Redis, count: int) -> np.ndarray:
+    # Up to `count` distinct random solutions, fewer if the set is smaller
+    with REDIS_SECONDS.labels(operation="retrieve_solutions").time():
+        entries = await r.srandmember("sudokus", count)
 
-    return constraints_to_grid(decode_ken(str(r.srandmember("sudokus"), 'utf8')))
+    return entries_to_grids(entries)
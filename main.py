@@ -8,7 +8,7 @@ def main():
     sampled_constraints = int(sys.argv[1])
 
     solution = retrieve_kropki_solution()
-    kropki, full_solution = generate_kropki(sampled_constraints)
+    kropki, full_solution, _ = generate_kropki(solution, sampled_constraints)
 
     print(encode_constraints(kropki))
     print(encode_constraints(full_solution))
@@ -0,0 +1,78 @@
+import os
+import shutil
+
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, \
+    generate_latest, multiprocess, start_http_server
+
+# Worker pools (the worker supervisor, the inline generation pool of the server) only report the metrics
+# of every process when PROMETHEUS_MULTIPROC_DIR points to a directory shared by all of them, and empty
+# when the pool starts: see the multiprocess mode of prometheus_client
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+if MULTIPROCESS:
+    # The first process to import this module drops the files of a previous run; the processes it
+    # starts inherit the marker and keep the directory as is
+    if "KROPKI_METRICS_DIR_OWNER" not in os.environ:
+        shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+        os.environ["KROPKI_METRICS_DIR_OWNER"] = str(os.getpid())
+
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+# Port of the metrics endpoint of the worker supervisor
+WORKER_METRICS_PORT = int(os.getenv("KROPKI_WORKER_METRICS_PORT", 9100))
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+_LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+_GENERATION_BUCKETS = (.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+_NODES_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 50000)
+
+SOLVER_SECONDS = Histogram("kropki_solver_seconds", "Duration of uniqueness solver calls", ["backend"],
+                           buckets=_LATENCY_BUCKETS)
+SEARCH_EXPANDED_NODES = Histogram("kropki_search_expanded_nodes", "Nodes expanded by a minimization search",
+                                  ["mode"], buckets=_NODES_BUCKETS)
+SEARCH_BUDGET_EXHAUSTED = Counter("kropki_search_budget_exhausted_total",
+                                  "Minimization searches stopped by their budget", ["mode"])
+GENERATION_SECONDS = Histogram("kropki_generation_seconds", "Wall time of a puzzle generation", ["sampling"],
+                               buckets=_GENERATION_BUCKETS)
+REDIS_SECONDS = Histogram("kropki_redis_seconds", "Duration of Redis round-trips", ["operation"],
+                          buckets=_LATENCY_BUCKETS)
+
+STOCK_PUZZLES = Gauge("kropki_stock_puzzles", "Puzzles in stock", ["sampling", "difficulty"],
+                      multiprocess_mode="mostrecent")
+SOLUTION_STORE_SIZE = Gauge("kropki_solution_store_size", "Solutions seen by the local store of a worker",
+                            multiprocess_mode="max")
+WORKER_JOBS = Counter("kropki_worker_jobs_total", "Worker jobs", ["kind"])
+WORKER_ERRORS = Counter("kropki_worker_errors_total", "Worker jobs that failed")
+WORKER_PUZZLES = Counter("kropki_worker_puzzles_total", "Puzzles stocked by workers")
+WORKER_JOB_SECONDS = Histogram("kropki_worker_job_seconds", "Duration of worker jobs", buckets=_GENERATION_BUCKETS)
+
+REQUEST_SECONDS = Histogram("kropki_request_seconds", "Time to respond to a puzzle request", ["endpoint"],
+                            buckets=_GENERATION_BUCKETS)
+PUZZLES_SERVED = Counter("kropki_puzzles_served_total", "Puzzles served", ["source"])
+DISPATCHER_PENDING = Gauge("kropki_dispatcher_pending", "Inline generations queued or running",
+                           multiprocess_mode="livesum")
+DISPATCHER_REJECTED = Counter("kropki_dispatcher_rejected_total", "Inline generations rejected by a full queue")
+
+
+def metrics_registry() -> CollectorRegistry:
+    if not MULTIPROCESS:
+        return REGISTRY
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+
+    return registry
+
+
+def latest_metrics() -> bytes:
+    return generate_latest(metrics_registry())
+
+
+def start_metrics_server(port: int = WORKER_METRICS_PORT):
+    start_http_server(port, registry=metrics_registry())
+
+
+def process_exited(pid: int):
+    # Drops the live gauges of a dead process in multiprocess mode
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
@@ -1,12 +1,10 @@
 import os
-import random
 from itertools import product, chain
 
 import redis
 import cpmpy as cp
 import numpy as np
 from cpmpy.expressions.variables import NDVarArray
-from loguru import logger
 
 
 def build_kropki_base_model() -> tuple[cp.Model, NDVarArray]:
@@ -26,26 +24,3 @@ def build_kropki_base_model() -> tuple[cp.Model, NDVarArray]:
 
     return model, grid
 
-
-
-def generate_kropki_solution(store=None):
-    if store is None:
-        store = []
-
-    model, solution = build_kropki_base_model()
-    s = cp.SolverLookup.get("ortools", model)
-    if store:
-        s.maximize(cp.sum(cp.sum(solution != v) for v in store))
-
-    solution_found = s.solve()
-
-    logger.info("Solution found: {}", solution_found)
-
-    if solution_found:
-        new_solution = solution.value()
-    elif not solution_found and store:
-        new_solution = random.choice(store)
-    else:
-        raise RuntimeError("No solution found!")
-
-    return new_solution
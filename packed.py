@@ -0,0 +1,85 @@
+from typing import Optional
+
+import numpy as np
+
+from bitboard import DOT_NONE
+
+# Fixed-width binary board record, 94 bytes:
+# - digits: 81 digits (0 for unknown cells) packed two per byte, low nibble first
+# - givens: 81-bit given mask, bit `r * 9 + c` for cell (r, c), little endian like the integer masks
+# - dots: bottom and right dot maps, 2 bits per cell, four cells per byte starting from the lowest bits
+BOARD_DTYPE = np.dtype([
+    ("digits", np.uint8, 41),
+    ("givens", np.uint8, 11),
+    ("dots", np.uint8, (2, 21)),
+])
+BOARD_SIZE = BOARD_DTYPE.itemsize
+
+_DOT_SHIFTS = np.array([0, 2, 4, 6], dtype=np.uint8)
+
+
+def pack_boards(digits: np.ndarray, givens: Optional[np.ndarray] = None, dots: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Packs a (n, 9, 9) batch of digits, an optional (n, 9, 9) boolean given mask (every cell by default)
+    and optional (n, 2, 9, 9) dot maps (no dots by default) into a (n,) array of BOARD_DTYPE records.
+    """
+    n = len(digits)
+    records = np.zeros(shape=n, dtype=BOARD_DTYPE)
+
+    padded = np.zeros(shape=(n, 82), dtype=np.uint8)
+    padded[:, :81] = np.asarray(digits).reshape(n, 81)
+    records["digits"] = padded[:, 0::2] | (padded[:, 1::2] << 4)
+
+    if givens is None:
+        givens = np.ones(shape=(n, 81), dtype=bool)
+    records["givens"] = np.packbits(np.asarray(givens, dtype=bool).reshape(n, 81), axis=1, bitorder="little")
+
+    if dots is not None:
+        padded = np.full(shape=(n, 2, 84), fill_value=DOT_NONE, dtype=np.uint8)
+        padded[:, :, :81] = np.asarray(dots).reshape(n, 2, 81)
+        records["dots"] = (padded.reshape(n, 2, 21, 4) << _DOT_SHIFTS).sum(axis=3, dtype=np.uint8)
+
+    return records
+
+
+def unpack_boards(records: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Inverse of pack_boards: (n, 9, 9) digits, (n, 9, 9) boolean givens and (n, 2, 9, 9) dot maps
+    n = len(records)
+
+    packed = records["digits"]
+    digits = np.stack([packed & 0xF, packed >> 4], axis=2).reshape(n, 82)[:, :81]
+
+    givens = np.unpackbits(records["givens"], axis=1, count=81, bitorder="little").astype(bool)
+
+    dots = (records["dots"][..., None] >> _DOT_SHIFTS) & 0b11
+    dots = dots.reshape(n, 2, 84)[:, :, :81]
+
+    return digits.reshape(n, 9, 9), givens.reshape(n, 9, 9), dots.reshape(n, 2, 9, 9)
+
+
+def pack_board(digits: np.ndarray, givens: Optional[np.ndarray] = None, dots: Optional[np.ndarray] = None) -> bytes:
+    return pack_boards(
+        np.asarray(digits)[None],
+        givens=np.asarray(givens)[None] if givens is not None else None,
+        dots=np.asarray(dots)[None] if dots is not None else None
+    ).tobytes()
+
+
+def frombuffer(data: bytes) -> np.ndarray:
+    # Zero-copy view of concatenated records
+    if len(data) % BOARD_SIZE:
+        raise ValueError(f"Invalid packed boards length! ({len(data)} is not a multiple of {BOARD_SIZE})")
+
+    return np.frombuffer(data, dtype=BOARD_DTYPE)
+
+
+def unpack_board(data: bytes) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    digits, givens, dots = unpack_boards(frombuffer(data))
+    return digits[0], givens[0], dots[0]
+
+
+def is_packed_board(data: bytes) -> bool:
+    # Text entries (KEN or JSON) may happen to be BOARD_SIZE long, but only the lowest bit of the last
+    # given byte is ever set in a record, and that byte is never a printable character
+    return len(data) == BOARD_SIZE and data[BOARD_DTYPE.fields["givens"][1] + 10] <= 1
+
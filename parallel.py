@@ -0,0 +1,103 @@
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterable
+
+import numpy as np
+
+from bitboard import mask_bits
+from generator import UniquenessOracle, SolverBackend, DEFAULT_SOLVER_BACKEND
+
+# Oracles built by the current pool process, most recently used last
+_oracles: OrderedDict[bytes, UniquenessOracle] = OrderedDict()
+_backend = DEFAULT_SOLVER_BACKEND
+
+MAX_WORKER_ORACLES = 4
+
+
+def _init_worker(backend: SolverBackend):
+    global _backend
+    _backend = backend
+
+
+def _is_unique(solution: np.ndarray, mask: int) -> tuple[int, bool]:
+    key = solution.tobytes()
+
+    if key not in _oracles:
+        _oracles[key] = UniquenessOracle(solution, backend=_backend)
+        if len(_oracles) > MAX_WORKER_ORACLES:
+            _oracles.popitem(last=False)
+
+    _oracles.move_to_end(key)
+
+    return mask, _oracles[key].is_unique(mask)
+
+
+class OraclePool:
+    """
+    Process pool answering uniqueness queries in parallel.
+
+    Workers are long-lived and keep the oracles of the last few solutions they have seen, so
+    consecutive queries for the same board reuse a warm solver. Results are written back into the
+    cache of the local oracle, which is also checked before anything is sent to the pool.
+    """
+
+    def __init__(self, processes: int = None, backend: SolverBackend = DEFAULT_SOLVER_BACKEND):
+        self.processes = processes or os.cpu_count()
+        self.executor = ProcessPoolExecutor(max_workers=self.processes, initializer=_init_worker,
+                                            initargs=(backend,))
+
+    def _lookup(self, oracle: UniquenessOracle, mask: int):
+        return oracle.cache.get(mask) if oracle.cache is not None else None
+
+    def _submit(self, oracle: UniquenessOracle, masks: Iterable[int]):
+        return [self.executor.submit(_is_unique, oracle.solution, mask) for mask in masks]
+
+    def _record(self, oracle: UniquenessOracle, mask: int, unique: bool):
+        oracle.solver_calls += 1
+        if oracle.cache is not None:
+            oracle.cache.put(mask, unique)
+
+    def is_minimal(self, mask: int, oracle: UniquenessOracle) -> bool:
+        reduced_masks = []
+        for bit in mask_bits(mask):
+            unique = self._lookup(oracle, mask & ~bit)
+            if unique:
+                return False
+            elif unique is None:
+                reduced_masks.append(mask & ~bit)
+
+        futures = self._submit(oracle, reduced_masks)
+        try:
+            for future in as_completed(futures):
+                reduced_mask, unique = future.result()
+                self._record(oracle, reduced_mask, unique)
+
+                if unique:
+                    return False
+        finally:
+            # Stop whatever has not started yet once the answer is known
+            for future in futures:
+                future.cancel()
+
+        return True
+
+    def filter_unique(self, masks: Iterable[int], oracle: UniquenessOracle) -> list[int]:
+        masks = list(masks)
+        known = {mask: self._lookup(oracle, mask) for mask in masks}
+
+        for future in as_completed(self._submit(oracle, [m for m, unique in known.items() if unique is None])):
+            mask, unique = future.result()
+            self._record(oracle, mask, unique)
+            known[mask] = unique
+
+        return [mask for mask in masks if known[mask]]
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
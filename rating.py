@@ -0,0 +1,200 @@
+from enum import IntEnum
+from itertools import combinations
+from typing import Callable
+
+import numpy as np
+
+from packed import unpack_board
+from solver import ALL_DIGITS, PEERS, UNITS, SUPPORT, POPCOUNT, KropkiSolver
+
+
+class Difficulty(IntEnum):
+    # Stored in corpus records, so values must not change
+    UNRATED = 0
+    EASY = 1
+    MEDIUM = 2
+    HARD = 3
+    EXPERT = 4
+
+
+PEER_SETS = tuple(frozenset(peers) for peers in PEERS)
+DIGIT_BITS = tuple(1 << v for v in range(9))
+
+DotNeighbors = list[list[tuple[int, int]]]
+
+
+class Contradiction(Exception):
+    pass
+
+
+def _singles(candidates: list[int], dot_neighbors: DotNeighbors) -> bool:
+    progress = False
+
+    # Naked singles: a placed digit is removed from every peer
+    for i, mask in enumerate(candidates):
+        if POPCOUNT[mask] == 1:
+            for j in PEERS[i]:
+                if candidates[j] & mask:
+                    candidates[j] &= ~mask
+                    progress = True
+
+    # Hidden singles: a digit with a single place left in a unit goes there
+    for unit in UNITS:
+        seen_once = 0
+        seen_twice = 0
+        for i in unit:
+            seen_twice |= seen_once & candidates[i]
+            seen_once |= candidates[i]
+
+        hidden = seen_once & ~seen_twice
+        if hidden:
+            for i in unit:
+                bit = candidates[i] & hidden
+                if bit and candidates[i] != bit:
+                    if POPCOUNT[bit] > 1:
+                        raise Contradiction()
+
+                    candidates[i] = bit
+                    progress = True
+
+    return progress
+
+
+def _dot_pairs(candidates: list[int], dot_neighbors: DotNeighbors) -> bool:
+    # A cell keeps only the digits that have a compatible digit across each of its dots
+    progress = False
+
+    for i, neighbors in enumerate(dot_neighbors):
+        for j, dot_type in neighbors:
+            reduced = candidates[i] & SUPPORT[dot_type][candidates[j]]
+            if reduced != candidates[i]:
+                candidates[i] = reduced
+                progress = True
+
+    return progress
+
+
+def _dot_chains(candidates: list[int], dot_neighbors: DotNeighbors) -> bool:
+    # In a chain a-b-c whose ends see each other, a digit of b needs two *different* compatible
+    # digits in a and c: e.g. b cannot be 1 in a white-white chain along a row, as both ends would have to be 2
+    progress = False
+
+    for b, neighbors in enumerate(dot_neighbors):
+        for (a, type_a), (c, type_c) in combinations(neighbors, 2):
+            if c not in PEER_SETS[a]:
+                continue
+
+            reduced = candidates[b]
+            for bit in DIGIT_BITS:
+                if reduced & bit:
+                    ends_a = candidates[a] & SUPPORT[type_a][bit]
+                    ends_c = candidates[c] & SUPPORT[type_c][bit]
+
+                    if not ends_a or not ends_c or (ends_a == ends_c and POPCOUNT[ends_a] == 1):
+                        reduced &= ~bit
+
+            if reduced != candidates[b]:
+                candidates[b] = reduced
+                progress = True
+
+    return progress
+
+
+def _subsets(candidates: list[int], dot_neighbors: DotNeighbors) -> bool:
+    progress = False
+
+    for unit in UNITS:
+        unsolved = [i for i in unit if POPCOUNT[candidates[i]] > 1]
+
+        for size in (2, 3):
+            # Naked subsets: `size` cells sharing `size` digits, which are removed from the rest of the unit
+            for cells in combinations(unsolved, size):
+                digits = 0
+                for i in cells:
+                    digits |= candidates[i]
+
+                if POPCOUNT[digits] == size:
+                    for i in unsolved:
+                        if i not in cells and candidates[i] & digits:
+                            candidates[i] &= ~digits
+                            progress = True
+
+            # Hidden subsets: `size` digits confined to `size` cells, which lose every other digit.
+            # Digits already placed in the unit may not have been removed from the other cells yet
+            free = 0
+            for i in unit:
+                if POPCOUNT[candidates[i]] > 1:
+                    free |= candidates[i]
+            for i in unit:
+                if POPCOUNT[candidates[i]] == 1:
+                    free &= ~candidates[i]
+
+            for bits in combinations([bit for bit in DIGIT_BITS if free & bit], size):
+                digits = sum(bits)
+                cells = [i for i in unsolved if candidates[i] & digits]
+
+                if len(cells) == size and all(any(candidates[i] & bit for i in cells) for bit in bits):
+                    for i in cells:
+                        if candidates[i] & ~digits:
+                            candidates[i] &= digits
+                            progress = True
+
+    return progress
+
+
+# Cheapest first: the solver always restarts from the top after any progress
+TECHNIQUES: tuple[tuple[Difficulty, Callable[[list[int], DotNeighbors], bool]], ...] = (
+    (Difficulty.EASY, _singles),
+    (Difficulty.EASY, _dot_pairs),
+    (Difficulty.MEDIUM, _dot_chains),
+    (Difficulty.HARD, _subsets),
+)
+
+
+def solve_logically(values: np.ndarray, dots: np.ndarray) -> tuple[list[int], Difficulty]:
+    """
+    Solves a puzzle the way a person would, using the techniques in TECHNIQUES and never guessing.
+    Returns the final candidate masks and the tier of the hardest technique that was needed;
+    the masks still have unsolved cells if the techniques were not enough.
+    """
+    dot_neighbors = KropkiSolver(dots).dot_neighbors
+    candidates = [1 << (int(v) - 1) if v else ALL_DIGITS for v in np.asarray(values).flat]
+    hardest = Difficulty.EASY
+
+    while any(POPCOUNT[mask] > 1 for mask in candidates):
+        for difficulty, technique in TECHNIQUES:
+            if technique(candidates, dot_neighbors):
+                hardest = max(hardest, difficulty)
+                break
+        else:
+            break
+
+        if not all(candidates):
+            raise Contradiction()
+
+    return candidates, hardest
+
+
+def rate_puzzle(values: np.ndarray, dots: np.ndarray) -> Difficulty:
+    # Puzzles that cannot be finished without guessing are rated EXPERT
+    candidates, hardest = solve_logically(values, dots)
+
+    return hardest if all(POPCOUNT[mask] == 1 for mask in candidates) else Difficulty.EXPERT
+
+
+def rate_board(puzzle: bytes) -> Difficulty:
+    digits, givens, dots = unpack_board(puzzle)
+
+    return rate_puzzle(np.where(givens, digits, 0), dots)
+
+
+def parse_difficulty(name: str) -> Difficulty:
+    try:
+        difficulty = Difficulty[name.upper()]
+    except KeyError:
+        difficulty = None
+
+    if difficulty is None or difficulty == Difficulty.UNRATED:
+        raise ValueError(f"Invalid difficulty: {name}")
+
+    return difficulty
@@ -1,11 +1,61 @@
-from fastapi import FastAPI
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, AsyncIterator
+
+import numpy as np
+import redis.asyncio
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, Response
+from loguru import logger
 
-from generator import generate_kropki
-from ken import encode_constraints, retrieve_kropki_solution
+from canonical import add_puzzles_async
+from corpus import Corpus, CORPUS_PATH
+from dispatch import GenerationDispatcher, DispatcherSaturated
+from inventory import pop_puzzles_async, push_puzzles_async, puzzle_to_ken, RatedPuzzle
+from ken import retrieve_kropki_solutions_async
+from metrics import REQUEST_SECONDS, PUZZLES_SERVED, METRICS_CONTENT_TYPE, latest_metrics
+from rating import Difficulty, parse_difficulty
 from worker import start_worker
 
-app = FastAPI()
+RETRY_AFTER_SECONDS = 5
+MAX_BATCH_SIZE = int(os.getenv("KROPKI_MAX_BATCH_SIZE", 50))
+# Requests wait for a free connection once the pool is exhausted
+REDIS_MAX_CONNECTIONS = int(os.getenv("KROPKI_REDIS_MAX_CONNECTIONS", 50))
+REDIS_POOL_TIMEOUT = float(os.getenv("KROPKI_REDIS_POOL_TIMEOUT", 5))
+
+dispatcher: GenerationDispatcher
+corpus: Optional[Corpus] = None
+redis_client: redis.asyncio.Redis
+
+
+def connect_redis() -> redis.asyncio.Redis:
+    pool = redis.asyncio.BlockingConnectionPool.from_url(os.getenv("REDIS_KEYS_URL"),
+                                                         max_connections=REDIS_MAX_CONNECTIONS,
+                                                         timeout=REDIS_POOL_TIMEOUT)
+    return redis.asyncio.Redis(connection_pool=pool)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global dispatcher, corpus, redis_client
+    dispatcher = GenerationDispatcher()
+    redis_client = connect_redis()
+
+    if CORPUS_PATH and os.path.exists(CORPUS_PATH):
+        corpus = Corpus(CORPUS_PATH)
+        logger.info("Serving puzzles from corpus {} ({} puzzles)", CORPUS_PATH, len(corpus))
+
+    yield
+
+    dispatcher.shutdown()
+    await redis_client.connection_pool.disconnect()
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:5173",
@@ -22,13 +72,148 @@ app.add_middleware(
 # start_worker()
 
 
+def parse_difficulty_param(difficulty: Optional[str]) -> Optional[Difficulty]:
+    if difficulty is None:
+        return None
+
+    try:
+        return parse_difficulty(difficulty)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+async def keep_closest(r: redis.asyncio.Redis, sampling: int, puzzles: list[RatedPuzzle]) -> tuple[RatedPuzzle, bool]:
+    # Generation puts the closest match to the requested difficulty last, the others go to the stock
+    # unless they are equivalent to a known puzzle. Also returns whether the closest one is new
+    added = await add_puzzles_async(r, [puzzle for puzzle, _ in puzzles])
+    await push_puzzles_async(r, sampling, [puzzle for puzzle, new in zip(puzzles[:-1], added) if new])
+
+    return puzzles[-1], added[-1]
+
+
 @app.post("/kropki")
-async def api_generate_kropki(sampling: int = 5):
-    solution = retrieve_kropki_solution()
-    kropki, full_solution = generate_kropki(solution, sampling)
+async def api_generate_kropki(sampling: int = Query(default=5, ge=0, le=81), difficulty: Optional[str] = None):
+    difficulty = parse_difficulty_param(difficulty)
+
+    with REQUEST_SECONDS.labels(endpoint="/kropki").time():
+        puzzle = None
+        source = "corpus"
+        if corpus is not None:
+            corpus.refresh_if_stale()
+            puzzle = corpus.pick(sampling=sampling, difficulty=difficulty)
+
+        r = redis_client
+        if puzzle is None:
+            puzzle = next(iter(await pop_puzzles_async(r, sampling, 1, difficulty)), None)
+            source = "stock"
+
+        # Out of stock (or sampling not stocked): generate inline
+        if puzzle is None:
+            source = "generated"
+            try:
+                puzzle, _ = await keep_closest(r, sampling, await dispatcher.generate(sampling, difficulty=difficulty))
+            except DispatcherSaturated:
+                logger.warning("Generation queue is full, rejecting request for sampling {}", sampling)
+                raise HTTPException(status_code=503, detail="Too many puzzles being generated, try again later",
+                                    headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+            except asyncio.TimeoutError:
+                raise HTTPException(status_code=504, detail="Puzzle generation timed out")
+
+    PUZZLES_SERVED.labels(source=source).inc()
+
+    return puzzle_to_ken(*puzzle)
+
+
+@app.get("/metrics")
+def api_metrics():
+    return Response(latest_metrics(), headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+
+def ndjson_line(item: dict) -> str:
+    return json.dumps(item) + "\n"
+
+
+async def stream_batch(r: redis.asyncio.Redis, puzzles: list[RatedPuzzle], sampling: int, difficulty: Optional[Difficulty],
+                       solutions: list[np.ndarray], missing: int) -> AsyncIterator[str]:
+    started = time.perf_counter()
+    for puzzle in puzzles:
+        yield ndjson_line(puzzle_to_ken(*puzzle))
+
+    # Every missing puzzle gets a line: there may be fewer stored solutions than puzzles to generate
+    for _ in range(missing - len(solutions)):
+        yield ndjson_line({"error": "No solution available to generate a puzzle"})
+
+    # Missing puzzles are generated concurrently on the free slots of the dispatcher, and streamed
+    # in completion order
+    running = set()
+    try:
+        while solutions or running:
+            while solutions and dispatcher.available:
+                running.add(dispatcher.submit(sampling, solutions.pop(), difficulty))
+
+            if not running:
+                # Other requests took every slot in the meantime
+                logger.warning("Generation queue is full, dropping {} puzzles of a batch", len(solutions))
+                for _ in solutions:
+                    yield ndjson_line({"error": "Too many puzzles being generated, try again later"})
+
+                return
+
+            done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    puzzle, new = await keep_closest(r, sampling, task.result())
+                except asyncio.TimeoutError:
+                    yield ndjson_line({"error": "Puzzle generation timed out"})
+                    continue
+                except Exception:
+                    logger.exception("Puzzle generation failed in a batch")
+                    yield ndjson_line({"error": "Puzzle generation failed"})
+                    continue
+
+                # A pack never holds a puzzle equivalent to one served before
+                if not new:
+                    yield ndjson_line({"error": "Generated puzzle is equivalent to a known one"})
+                    continue
+
+                yield ndjson_line(puzzle_to_ken(*puzzle))
+                PUZZLES_SERVED.labels(source="generated").inc()
+    finally:
+        # The client went away: generations keep running, but nobody waits for them anymore
+        for task in running:
+            task.cancel()
+
+        REQUEST_SECONDS.labels(endpoint="/kropki/batch").observe(time.perf_counter() - started)
+
+
+@app.post("/kropki/batch")
+async def api_generate_kropki_batch(count: int = Query(default=10, ge=1, le=MAX_BATCH_SIZE),
+                                    sampling: int = Query(default=5, ge=0, le=81),
+                                    difficulty: Optional[str] = None):
+    difficulty = parse_difficulty_param(difficulty)
+
+    puzzles = []
+    if corpus is not None:
+        corpus.refresh_if_stale()
+        puzzles = [
+            puzzle for puzzle in (corpus.pick(sampling=sampling, difficulty=difficulty) for _ in range(count))
+            if puzzle is not None
+        ]
+
+    PUZZLES_SERVED.labels(source="corpus").inc(len(puzzles))
+
+    r = redis_client
+    stocked = await pop_puzzles_async(r, sampling, count - len(puzzles), difficulty)
+    PUZZLES_SERVED.labels(source="stock").inc(len(stocked))
+    puzzles += stocked
+    missing = count - len(puzzles)
+
+    if missing and not puzzles and not dispatcher.available:
+        logger.warning("Generation queue is full, rejecting batch of {} for sampling {}", count, sampling)
+        raise HTTPException(status_code=503, detail="Too many puzzles being generated, try again later",
+                            headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
 
-    return {
-        "ken": encode_constraints(kropki),
-        "solution": encode_constraints(full_solution)
-    }
+    solutions = list(await retrieve_kropki_solutions_async(r, missing)) if missing else []
 
+    return StreamingResponse(stream_batch(r, puzzles, sampling, difficulty, solutions, missing),
+                             media_type="application/x-ndjson")
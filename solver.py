@@ -0,0 +1,199 @@
+from typing import Optional
+
+import numpy as np
+
+from bitboard import BOTTOM, DOT_WHITE, DOT_BLACK
+
+# Candidates of a cell are 9-bit masks, bit `v - 1` standing for digit `v`
+ALL_DIGITS = (1 << 9) - 1
+
+
+def _peers(i: int) -> tuple[int, ...]:
+    r, c = divmod(i, 9)
+    box_r, box_c = r - r % 3, c - c % 3
+
+    peers = {r * 9 + k for k in range(9)} | {k * 9 + c for k in range(9)} | \
+            {(box_r + dr) * 9 + box_c + dc for dr in range(3) for dc in range(3)}
+
+    return tuple(sorted(peers - {i}))
+
+
+PEERS = tuple(_peers(i) for i in range(81))
+UNITS = tuple(
+    [tuple(r * 9 + c for c in range(9)) for r in range(9)] +
+    [tuple(r * 9 + c for r in range(9)) for c in range(9)] +
+    [tuple((br + dr) * 9 + bc + dc for dr in range(3) for dc in range(3)) for br in (0, 3, 6) for bc in (0, 3, 6)]
+)
+
+
+def _compatible_digits(dot_type: int, v: int) -> int:
+    if dot_type == DOT_WHITE:
+        others = {v - 1, v + 1}
+    else:
+        others = {v * 2} | ({v // 2} if v % 2 == 0 else set())
+
+    return sum(1 << (o - 1) for o in others if 1 <= o <= 9)
+
+
+def _supported_digits(dot_type: int, mask: int) -> int:
+    supported = 0
+    for v in range(1, 10):
+        if mask & (1 << (v - 1)):
+            supported |= _compatible_digits(dot_type, v)
+
+    return supported
+
+
+# SUPPORT[dot_type][mask]: digits that can sit across a dot of type `dot_type` from a cell with candidates `mask`
+SUPPORT = {
+    dot_type: tuple(_supported_digits(dot_type, mask) for mask in range(ALL_DIGITS + 1))
+    for dot_type in (DOT_WHITE, DOT_BLACK)
+}
+
+POPCOUNT = tuple(mask.bit_count() for mask in range(ALL_DIGITS + 1))
+
+
+def _dot_neighbors(dots: np.ndarray) -> list[list[tuple[int, int]]]:
+    neighbors = [[] for _ in range(81)]
+
+    for direction, r, c in zip(*np.nonzero(dots)):
+        i = r * 9 + c
+        j = i + 9 if direction == BOTTOM else i + 1
+        dot_type = int(dots[direction, r, c])
+
+        neighbors[i].append((j, dot_type))
+        neighbors[j].append((i, dot_type))
+
+    return neighbors
+
+
+class KropkiSolver:
+    """
+    Bitmask backtracking solver for Kropki Sudoku.
+
+    Each cell keeps a mask of candidate digits. Fixed digits are removed from their peers, dots
+    restrict the candidates across them to compatible digits, and hidden singles are placed,
+    until a fixpoint is reached; then the search branches on the cell with fewest candidates.
+    Like the cpmpy model, only the dots that are present constrain the board: a missing dot says
+    nothing about the two cells.
+    """
+
+    def __init__(self, dots: np.ndarray):
+        self.dot_neighbors = _dot_neighbors(dots)
+
+    def propagate(self, grid: np.ndarray) -> Optional[list[int]]:
+        # Candidate masks left by propagation alone, or None if the givens are contradictory.
+        # `grid` holds the givens, 0 stands for an empty cell
+        candidates = [ALL_DIGITS] * 81
+        queue = []
+        for i, v in enumerate(np.asarray(grid).flat):
+            if v:
+                candidates[i] = 1 << (int(v) - 1)
+                queue.append(i)
+
+        # Dots constrain cells even when no digit is known yet
+        queue.extend(i for i in range(81) if self.dot_neighbors[i])
+
+        return self._propagate(candidates, queue)
+
+    def find_solutions(self, grid: np.ndarray, limit: int = 2) -> list[np.ndarray]:
+        solutions = []
+        candidates = self.propagate(grid)
+        if candidates is not None:
+            self._search(candidates, solutions, limit)
+
+        return [np.array([c.bit_length() for c in s]).reshape(9, 9) for s in solutions]
+
+    def count_solutions(self, grid: np.ndarray, limit: int = 2) -> int:
+        return len(self.find_solutions(grid, limit))
+
+    def _search(self, candidates: list[int], solutions: list, limit: int):
+        best = None
+        best_count = 10
+        for i, c in enumerate(candidates):
+            count = POPCOUNT[c]
+            if 1 < count < best_count:
+                best, best_count = i, count
+                if count == 2:
+                    break
+
+        if best is None:
+            solutions.append(candidates)
+            return
+
+        mask = candidates[best]
+        while mask and len(solutions) < limit:
+            bit = mask & -mask
+            mask ^= bit
+
+            branch = candidates.copy()
+            branch[best] = bit
+            branch = self._propagate(branch, [best])
+            if branch is not None:
+                self._search(branch, solutions, limit)
+
+    def _propagate(self, candidates: list[int], queue: list[int]) -> Optional[list[int]]:
+        dot_neighbors = self.dot_neighbors
+        pending = set(queue)
+
+        while queue:
+            while queue:
+                i = queue.pop()
+                pending.discard(i)
+                mask = candidates[i]
+
+                if POPCOUNT[mask] == 1:
+                    for j in PEERS[i]:
+                        if candidates[j] & mask:
+                            reduced = candidates[j] & ~mask
+                            if not reduced:
+                                return None
+
+                            candidates[j] = reduced
+                            if j not in pending:
+                                pending.add(j)
+                                queue.append(j)
+
+                for j, dot_type in dot_neighbors[i]:
+                    reduced = candidates[j] & SUPPORT[dot_type][mask]
+                    if reduced != candidates[j]:
+                        if not reduced:
+                            return None
+
+                        candidates[j] = reduced
+                        if j not in pending:
+                            pending.add(j)
+                            queue.append(j)
+
+            # Hidden singles: a digit with a single possible place in a unit
+            for unit in UNITS:
+                seen_once = 0
+                seen_twice = 0
+                fixed = 0
+                for i in unit:
+                    c = candidates[i]
+                    seen_twice |= seen_once & c
+                    seen_once |= c
+                    if POPCOUNT[c] == 1:
+                        fixed |= c
+
+                if seen_once != ALL_DIGITS:
+                    return None
+
+                hidden = seen_once & ~seen_twice & ~fixed
+                if hidden:
+                    for i in unit:
+                        c = candidates[i] & hidden
+                        if c:
+                            if POPCOUNT[c] > 1:
+                                return None
+
+                            candidates[i] = c
+                            pending.add(i)
+                            queue.append(i)
+
+        return candidates
+
+
+def count_solutions(grid: np.ndarray, dots: np.ndarray, limit: int = 2) -> int:
+    return KropkiSolver(dots).count_solutions(grid, limit)
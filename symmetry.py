@@ -0,0 +1,68 @@
+import os
+from typing import Optional
+
+import numpy as np
+
+from bitboard import dot_maps
+from canonical import puzzle_hash
+from grids import random_line_permutations, transform_grids
+from packed import pack_board, unpack_board
+from solver import KropkiSolver
+
+# Variants tried for every generated puzzle
+PUZZLE_VARIANTS = int(os.getenv("KROPKI_PUZZLE_VARIANTS", 8))
+
+
+def minimize_givens(values: np.ndarray, solver: KropkiSolver) -> np.ndarray:
+    # Uniqueness is monotone in the givens, so a single removal pass leaves a minimal set
+    values = values.copy()
+    for r, c in zip(*np.nonzero(values)):
+        value = values[r, c]
+        values[r, c] = 0
+
+        if solver.count_solutions(values) != 1:
+            values[r, c] = value
+
+    return values
+
+
+def puzzle_variants(puzzle: bytes, count: int = PUZZLE_VARIANTS,
+                    rng: Optional[np.random.Generator] = None) -> list[bytes]:
+    """
+    Makes up to `count` new puzzles out of a packed one, without searching again.
+
+    The solution is transposed and its bands, stacks, rows and columns are shuffled, and the givens
+    move along. Dots are recomputed for the new solution, so a variant is a different puzzle whose
+    uniqueness is checked with the bitboard solver, and whose givens are then trimmed back to a minimal set.
+    Rotations, reflections and digit relabelings are not used: the first ones give equivalent puzzles,
+    and no relabeling but the identity keeps the dots of a solution.
+    Variants equivalent to the puzzle or to each other are dropped.
+    """
+    rng = rng or np.random.default_rng()
+    digits, givens, _ = unpack_board(puzzle)
+
+    row_perms = random_line_permutations(count, rng)
+    col_perms = random_line_permutations(count, rng)
+    identity = np.tile(np.arange(10, dtype=np.uint8), (count, 1))
+    transpose = rng.random(count) < 0.5
+
+    solutions = transform_grids(np.repeat(digits[None], count, axis=0), row_perms, col_perms, identity, transpose)
+    masks = transform_grids(np.repeat(givens[None].astype(np.uint8), count, axis=0), row_perms, col_perms, identity,
+                            transpose).astype(bool)
+    dots = dot_maps(solutions)
+
+    seen = {puzzle_hash(puzzle)}
+    variants = []
+    for solution, mask, solution_dots in zip(solutions, masks, dots):
+        solver = KropkiSolver(solution_dots)
+        values = np.where(mask, solution, 0)
+        if solver.count_solutions(values) != 1:
+            continue
+
+        variant = pack_board(solution, minimize_givens(values, solver) != 0, solution_dots)
+        variant_hash = puzzle_hash(variant)
+        if variant_hash not in seen:
+            seen.add(variant_hash)
+            variants.append(variant)
+
+    return variants
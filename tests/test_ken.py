@@ -0,0 +1,159 @@
+import re
+
+import numpy as np
+import pytest
+
+from bitboard import BOTTOM, RIGHT, DOT_NONE, DOT_WHITE, DOT_BLACK
+from ken import encode_ken, decode_ken_arrays, encode_constraints, decode_ken
+
+GRID = np.array([
+    [1, 2, 3, 4, 5, 6, 7, 8, 9],
+    [4, 5, 6, 7, 8, 9, 1, 2, 3],
+    [7, 8, 9, 1, 2, 3, 4, 5, 6],
+    [2, 3, 4, 5, 6, 7, 8, 9, 1],
+    [5, 6, 7, 8, 9, 1, 2, 3, 4],
+    [8, 9, 1, 2, 3, 4, 5, 6, 7],
+    [3, 4, 5, 6, 7, 8, 9, 1, 2],
+    [6, 7, 8, 9, 1, 2, 3, 4, 5],
+    [9, 1, 2, 3, 4, 5, 6, 7, 8],
+], dtype=np.uint8)
+
+EMPTY_ROW = "HA"
+
+
+def random_board(rng: np.random.Generator, givens: float, dotted: float) -> tuple[np.ndarray, np.ndarray]:
+    values = (rng.integers(1, 10, size=(9, 9)) * (rng.random((9, 9)) < givens)).astype(np.uint8)
+    dots = (rng.choice([DOT_WHITE, DOT_BLACK], size=(2, 9, 9)) * (rng.random((2, 9, 9)) < dotted)).astype(np.uint8)
+
+    return values, dots
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_round_trip(seed):
+    rng = np.random.default_rng(seed)
+    values, dots = random_board(rng, givens=rng.random(), dotted=rng.random())
+
+    decoded_values, decoded_dots = decode_ken_arrays(encode_ken(values, dots))
+
+    assert (decoded_values == values).all()
+    assert (decoded_dots == dots).all()
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_round_trip_without_dots(seed):
+    values, _ = random_board(np.random.default_rng(seed), givens=0.3, dotted=0)
+
+    ken = encode_ken(values)
+    decoded_values, decoded_dots = decode_ken_arrays(ken)
+
+    assert "(" not in ken
+    assert (decoded_values == values).all()
+    assert (decoded_dots == DOT_NONE).all()
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_decodes_without_trailing_empty_cells(seed):
+    # Older encoders dropped the run of empty cells at the end of the board
+    values, dots = random_board(np.random.default_rng(seed), givens=0.3, dotted=0.3)
+    values[8, 4:] = 0
+    dots[:, 8, 4:] = DOT_NONE
+
+    ken = encode_ken(values, dots)
+    legacy = re.sub("[A-I]+$", "", ken)
+    assert legacy != ken
+
+    decoded_values, decoded_dots = decode_ken_arrays(legacy)
+
+    assert (decoded_values == values).all()
+    assert (decoded_dots == dots).all()
+
+
+def test_decodes_legacy_board():
+    ken = "/".join(["123456789"] * 8 + ["9(1xw)"])
+
+    values, dots = decode_ken_arrays(ken)
+
+    assert (values[:8] == np.arange(1, 10)).all()
+    assert values[8].tolist() == [9, 1, 0, 0, 0, 0, 0, 0, 0]
+    assert dots[RIGHT, 8, 1] == DOT_WHITE
+    assert np.count_nonzero(dots) == 1
+
+
+def test_empty_rows():
+    values = np.zeros(shape=(9, 9), dtype=np.uint8)
+    values[4] = GRID[4]
+
+    ken = encode_ken(values)
+
+    assert ken == "/".join([EMPTY_ROW] * 4 + ["567891234"] + [EMPTY_ROW] * 4)
+    assert (decode_ken_arrays(ken)[0] == values).all()
+
+
+def test_empty_board():
+    ken = encode_ken(np.zeros(shape=(9, 9), dtype=np.uint8))
+
+    assert ken == "/".join([EMPTY_ROW] * 9)
+    values, dots = decode_ken_arrays(ken)
+    assert not values.any() and not dots.any()
+
+
+def test_dotted_empty_cells():
+    values, dots = decode_ken_arrays("/".join(["(xk)H"] + [EMPTY_ROW] * 7 + ["G(wx)A"]))
+
+    assert not values.any()
+    assert dots[RIGHT, 0, 0] == DOT_BLACK and dots[BOTTOM, 0, 0] == DOT_NONE
+    assert dots[BOTTOM, 8, 7] == DOT_WHITE and dots[RIGHT, 8, 7] == DOT_NONE
+    assert np.count_nonzero(dots) == 2
+
+
+def test_full_grid():
+    ken = encode_ken(GRID)
+
+    assert ken == "/".join("".join(map(str, row)) for row in GRID)
+    assert (decode_ken_arrays(ken)[0] == GRID).all()
+
+
+def test_constraints_round_trip():
+    rng = np.random.default_rng(0)
+    values, dots = random_board(rng, givens=0.3, dotted=0.3)
+    dots[BOTTOM, 8] = DOT_NONE
+    dots[RIGHT, :, 8] = DOT_NONE
+
+    constraints = decode_ken(encode_ken(values, dots))
+
+    assert decode_ken(encode_constraints(constraints)) == constraints
+
+
+@pytest.mark.parametrize("ken", [
+    "Z" + "/HA" * 8,
+    "(1wxk)H" + "/HA" * 8,
+    "(9)H" + "/HA" * 8,
+    "0H" + "/HA" * 8,
+    "1234 56789" + "/HA" * 8,
+])
+def test_invalid_tokens(ken):
+    with pytest.raises(ValueError, match="Invalid KEN"):
+        decode_ken_arrays(ken)
+
+
+@pytest.mark.parametrize("ken", [
+    "1234567891" + "/HA" * 8,
+    "IA" + "/HA" * 8,
+    "5E" + "/HA" * 8,
+    "H" + "/HA" * 8,
+    "/".join([EMPTY_ROW] * 8 + ["HB"]),
+])
+def test_invalid_row_lengths(ken):
+    with pytest.raises(ValueError, match="row 0|row 8"):
+        decode_ken_arrays(ken)
+
+
+@pytest.mark.parametrize("ken", [
+    "/".join([EMPTY_ROW] * 8),
+    "",
+    "/".join([EMPTY_ROW] * 10),
+    "/".join([EMPTY_ROW] * 9 + ["1"]),
+])
+def test_invalid_row_counts(ken):
+    with pytest.raises(RuntimeError, match="number of rows"):
+        decode_ken_arrays(ken)
@@ -1,52 +1,239 @@
 import os
-import re
+import signal
+import socket
+import threading
 import traceback
+from typing import Optional
 
 import numpy as np
 
 from multiprocessing import Process
-from time import sleep
-from generator import CellConstraint, grid_coords, DotType, DotConstraint
-from model import generate_kropki_solution
-from ken import constraints_to_grid, decode_ken
-from ken import encode_constraints, retrieve_kropki_solution
+from time import sleep, time
+from grids import random_grids
+from ken import encode_ken, retrieve_kropki_solution, redis_client
+from packed import pack_board
+from bitboard import dot_maps
+from inventory import next_bucket_to_refill, make_rated_puzzles, push_puzzle, puzzle_to_ken
+from corpus import CorpusWriter, CORPUS_PATH
+from canonical import add_grid, add_puzzle
+from symmetry import puzzle_variants
+from metrics import WORKER_JOBS, WORKER_ERRORS, WORKER_PUZZLES, WORKER_JOB_SECONDS, SOLUTION_STORE_SIZE, \
+    start_metrics_server, process_exited, WORKER_METRICS_PORT
+from rating import Difficulty, rate_board
+from diversity import SolutionStore, SOLUTIONS_KEY, DIVERSITY_CANDIDATES, add_solution, most_diverse
 
 import redis
 
 from loguru import logger
 
+WORKER_PROCESSES = int(os.getenv("KROPKI_WORKER_PROCESSES", os.cpu_count()))
 
-def start_worker():
-    p = Process(target=worker_generate_kropki)
-    p.start()
+# Workers refresh their heartbeat every interval; a worker missing a few of them is considered dead
+HEARTBEAT_INTERVAL = 10
+HEARTBEAT_TTL = 3 * HEARTBEAT_INTERVAL
+WORKERS_KEY = "kropki:workers"
+
+
+def worker_key(worker_id: str) -> str:
+    return f"kropki:workers:{worker_id}"
+
+
+class WorkerStats:
+    def __init__(self):
+        self.started_at = time()
+        self.jobs = 0
+        self.puzzles = 0
+        self.solutions = 0
+        self.errors = 0
+        self.last_job_seconds = 0.0
+
+    def as_mapping(self) -> dict:
+        uptime = time() - self.started_at
+
+        return {
+            "started_at": self.started_at,
+            "jobs": self.jobs,
+            "puzzles": self.puzzles,
+            "solutions": self.solutions,
+            "errors": self.errors,
+            "last_job_seconds": self.last_job_seconds,
+            "jobs_per_minute": 60 * self.jobs / uptime if uptime > 0 else 0,
+        }
+
+
+def start_worker(processes: int = WORKER_PROCESSES) -> list[Process]:
+    workers = [Process(target=worker_generate_kropki) for _ in range(processes)]
+    for p in workers:
+        p.start()
+
+    return workers
+
+
+def run_supervisor(processes: int = WORKER_PROCESSES):
+    # Keeps `processes` workers alive until SIGTERM/SIGINT, which is forwarded to every worker so that
+    # they can finish their current job before exiting
+    stopping = threading.Event()
+
+    def stop(signum, frame):
+        logger.info("Received signal {}, stopping workers...", signum)
+        stopping.set()
+
+    workers = start_worker(processes)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    logger.info("Started {} workers", processes)
+
+    start_metrics_server(WORKER_METRICS_PORT)
+    logger.info("Serving worker metrics on port {}", WORKER_METRICS_PORT)
+
+    while not stopping.wait(1):
+        for i, p in enumerate(workers):
+            if not p.is_alive():
+                logger.warning("Worker {} exited with code {}, restarting it", p.pid, p.exitcode)
+                process_exited(p.pid)
+                workers[i] = Process(target=worker_generate_kropki)
+                workers[i].start()
+
+    for p in workers:
+        if p.is_alive():
+            os.kill(p.pid, signal.SIGTERM)
+
+    for p in workers:
+        p.join()
+        process_exited(p.pid)
+
+    logger.info("All workers stopped")
+
+
+def publish_heartbeat(r: redis.Redis, worker_id: str, stats: WorkerStats):
+    pipeline = r.pipeline()
+    pipeline.hset(worker_key(worker_id), mapping=stats.as_mapping())
+    pipeline.expire(worker_key(worker_id), HEARTBEAT_TTL)
+    pipeline.zadd(WORKERS_KEY, {worker_id: time()})
+    pipeline.zremrangebyscore(WORKERS_KEY, "-inf", time() - HEARTBEAT_TTL)
+    pipeline.execute()
 
 
 def worker_generate_kropki():
-    while True:
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    # Shared by the heartbeat thread and the jobs
+    r = redis_client()
+    stats = WorkerStats()
+    store = SolutionStore()
+    # Generated puzzles are also kept in the local corpus, if any
+    corpus = CorpusWriter(CORPUS_PATH) if CORPUS_PATH else None
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    # Ctrl-C reaches the whole process group, let the supervisor decide
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    def heartbeat():
+        while not stopping.wait(HEARTBEAT_INTERVAL):
+            try:
+                publish_heartbeat(r, worker_id, stats)
+            except redis.RedisError as e:
+                logger.warning("Cannot publish heartbeat: {}", e)
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+    logger.info("Worker {} started", worker_id)
+
+    while not stopping.is_set():
+        start = time()
         try:
-            worker_generate_kropki_impl()
+            worker_generate_kropki_impl(r, stats, store, corpus)
         except Exception as e:
+            stats.errors += 1
+            WORKER_ERRORS.inc()
             logger.error("Exception while generating new solution: {}", e)
             traceback.print_exc()
-
-
-def worker_generate_kropki_impl():
+            sleep(1)
+        finally:
+            stats.jobs += 1
+            stats.last_job_seconds = time() - start
+            WORKER_JOB_SECONDS.observe(stats.last_job_seconds)
+
+    r.delete(worker_key(worker_id))
+    r.zrem(WORKERS_KEY, worker_id)
+    r.connection_pool.disconnect()
+    if corpus is not None:
+        corpus.close()
+    logger.info("Worker {} stopped after {} jobs", worker_id, stats.jobs)
+
+
+def worker_generate_kropki_impl(r: redis.Redis, stats: WorkerStats, store: SolutionStore,
+                                corpus: Optional[CorpusWriter] = None):
+    # Finished puzzles are served directly, so keeping them in stock comes first
+    bucket = next_bucket_to_refill(r)
+    if bucket is not None and r.scard(SOLUTIONS_KEY) > 0:
+        WORKER_JOBS.labels(kind="puzzle").inc()
+        sampling, difficulty = bucket
+        stocked = worker_refill_stock(r, sampling, difficulty, corpus)
+        stats.puzzles += stocked
+        WORKER_PUZZLES.inc(stocked)
+    else:
+        WORKER_JOBS.labels(kind="solution").inc()
+        worker_generate_solution(r, store)
+        stats.solutions += 1
+
+
+def stock_puzzle(r, sampling, puzzle: bytes, difficulty: Optional[Difficulty] = None,
+                 corpus: Optional[CorpusWriter] = None) -> bool:
+    if not add_puzzle(r, puzzle):
+        logger.info("Puzzle is equivalent to a known one, dropping it")
+        return False
+
+    if difficulty is None:
+        difficulty = rate_board(puzzle)
+    push_puzzle(r, sampling, puzzle, difficulty)
+
+    if corpus is not None:
+        corpus.append(puzzle, sampling, difficulty)
+
+    logger.info("Generated new {} puzzle: {}", difficulty.name.lower(), puzzle_to_ken(puzzle)["ken"])
+
+    return True
+
+
+def worker_refill_stock(r, sampling, difficulty: Optional[Difficulty] = None,
+                        corpus: Optional[CorpusWriter] = None) -> int:
+    # Returns the number of puzzles stocked: the generated ones (every attempt at the difficulty, if
+    # any) and their variants
+    logger.info("Generating new puzzle for sampling {} ({} difficulty)...", sampling,
+                difficulty.name.lower() if difficulty is not None else "any")
+
+    stocked = 0
+    for puzzle, rating in make_rated_puzzles(retrieve_kropki_solution(r), sampling, difficulty):
+        if stock_puzzle(r, sampling, puzzle, rating, corpus):
+            stocked += 1 + sum(stock_puzzle(r, sampling, variant, corpus=corpus) for variant in puzzle_variants(puzzle))
+
+    return stocked
+
+
+def worker_generate_solution(r, store: SolutionStore):
     logger.info("Constructing new solution...")
-    r = redis.from_url(os.getenv("REDIS_KEYS_URL"))
-    sudokus = r.smembers("sudokus")
-    store = [constraints_to_grid(decode_ken(str(s, 'utf8'))) for s in sudokus]
+    new_solutions = store.refresh(r)
+    SOLUTION_STORE_SIZE.set(len(store))
 
-    logger.info("Store has {} elements", len(store))
-    solution = generate_kropki_solution(store)
+    logger.info("Store has {} elements ({} new), scoring against {}", len(store), new_solutions, len(store.sample))
+    candidates = random_grids(DIVERSITY_CANDIDATES)
 
-    constraints = set({CellConstraint(cell, solution[*cell]) for cell in grid_coords()})
+    # Candidates equivalent to a stored solution would only yield equivalent puzzles
+    while True:
+        i = most_diverse(candidates, store.sample)
+        solution = candidates[i]
+        if add_grid(r, solution):
+            break
 
-    encoded_solution = encode_constraints(constraints)
-    r.sadd("sudokus", encoded_solution)
+        candidates = np.delete(candidates, i, axis=0)
+        if len(candidates) == 0:
+            logger.info("Every candidate is equivalent to a stored solution")
+            return
 
-    logger.info("Generated new sudoku: {}", encoded_solution)
+    add_solution(r, pack_board(solution, dots=dot_maps(solution)))
 
+    logger.info("Generated new sudoku: {}", encode_ken(solution))
 
-if __name__ == "__main__":
-    start_worker()
 
+if __name__ == "__main__":
+    run_supervisor()